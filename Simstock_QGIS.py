@@ -324,13 +324,10 @@ class SimstockQGIS:
         sys.path.append(decorator_dir)
 
         # Set up Eppy
-        from eppy.modeleditor import IDF, IDDAlreadySetError
+        from simstockidd import set_idd
         if self.system in ['windows', 'linux', 'darwin']:
             iddfile = os.path.join(self.EP_DIR, 'ep8.9_{}/Energy+.idd'.format(self.system))
-        try:
-            IDF.setiddname(iddfile)
-        except IDDAlreadySetError:
-            pass
+        set_idd(iddfile)
 
 
         ### OTHER
@@ -903,15 +900,20 @@ class SimstockQGIS:
         # Import and run Simstock
         import simstockone as first
         import simstocktwo as second
-        first.main()
-        self.preprocessed_df = pd.read_csv(os.path.join(self.plugin_dir, "sa_preprocessed.csv"))
-        second.main(idf_dir=self.idf_dir)
+        from simstocktables import read_table
+        first.main(python=getattr(self, "qgis_python_location", None),
+                   cwd=self.user_cwd)
+        self.preprocessed_df = read_table(self.plugin_dir, "sa_preprocessed",
+                                          columns=["osgb", "bi", "shading", "nofloors"])
+        second.main(idf_dir=self.idf_dir,
+                    python=getattr(self, "qgis_python_location", None))
         
 
         ### ENERGYPLUS
         # Run E+ simulation, generate .rvi files and run ReadVarsESO
-        unique_bis = self.preprocessed_df[self.preprocessed_df["shading"]==False]["bi"].unique()
-        self.idf_files = [os.path.join(self.idf_dir, f"{bi}.idf") for bi in unique_bis]
+        # The idfs created for each BI (a large BI can be split into several)
+        idf_table = read_table(self.plugin_dir, "sa_idf_files", columns=["idf"])
+        self.idf_files = [os.path.join(self.idf_dir, f"{idf}.idf") for idf in idf_table["idf"]]
         self.idf_result_dirs = self.run_simulation(multiprocessing=self.dlg.cbMulti.isChecked()) #check if mp checkbox is ticked
         if self.idf_result_dirs is None:
             return
@@ -1216,6 +1218,9 @@ class SimstockQGIS:
         TODO: move result fetching fns elsewhere.
         """
 
+        # Number of floors represented by each thermal zone
+        zone_multipliers = {}
+
         def getzones(idf):
             """Finds thermal zones in idf and outputs numpy array."""
             all_zones = np.array([zone.Name for zone in idf.idfobjects["ZONE"]])
@@ -1256,6 +1261,10 @@ class SimstockQGIS:
                 # Get zone names from within the idf
                 zonelist = getzones(idf)
 
+                # Zone multiplier of each zone (see 'Zone multipliers - experimental' in config.json)
+                for zone in idf.idfobjects["ZONE"]:
+                    zone_multipliers[zone.Name] = int(zone.Multiplier or 1)
+
                 # Loop through the idf zones and look for the corresponding result columns
                 for zone in zonelist:
                     zonename = zone.upper() #E+ outputs zone names in caps in results
@@ -1454,20 +1463,34 @@ class SimstockQGIS:
                     if len(thermal_zones) != 0:
 
                         # Loop through the thermal zones belonging to the feature
-                        for j, zone in enumerate(thermal_zones):
+                        floor_no = 0
+                        for zone in thermal_zones:
 
                             # Check the order is correct
-                            print(f"    Found results for floor {j+1}: '{zone}'")
-                            if zone[-1] != str(j+1):    #TODO: this only works for single digit floors
+                            if zone[-1] != str(floor_no+1):    #TODO: this only works for single digit floors
                                 logging.warning(f"Floor results are in the wrong order for zone '{zone}'.")
 
-                            # Collect the results for the thermal zone
-                            result_vals.extend(extracted_results[zone])
-
-                            # Append values for calculating totals (needs generalising)
-                            elec_tot.append(extracted_results[zone][-3])
-                            heat_tot.append(extracted_results[zone][-2])
-                            cool_tot.append(extracted_results[zone][-1])
+                            # A zone with a zone multiplier holds the results of as many
+                            # consecutive floors, starting from the floor it is named after.
+                            # E+ multiplies the zone load before the ideal loads system
+                            # meets it, so its heating and cooling are shared between the
+                            # floors (not yet verified against simulations without zone
+                            # multipliers). Electricity and temperatures are those of one floor
+                            multiplier = zone_multipliers.get(zone, 1)
+                            floor_results = list(extracted_results[zone])
+                            floor_results[-2] = round(floor_results[-2] / multiplier, 2)
+                            floor_results[-1] = round(floor_results[-1] / multiplier, 2)
+                            for _ in range(multiplier):
+                                floor_no += 1
+                                print(f"    Found results for floor {floor_no}: '{zone}'")
+
+                                # Collect the results for the thermal zone
+                                result_vals.extend(floor_results)
+
+                                # Append values for calculating totals (needs generalising)
+                                elec_tot.append(floor_results[-3])
+                                heat_tot.append(floor_results[-2])
+                                cool_tot.append(floor_results[-1])
 
                         # Calculate totals
                         #result_vals.append("r_path_here") #inprogress
@@ -1531,13 +1554,11 @@ class SimstockQGIS:
 
 
         # Set up Eppy
-        from eppy.modeleditor import IDF, IDDAlreadySetError
+        from eppy.modeleditor import IDF
+        from simstockidd import set_idd
         if self.system in ['windows', 'linux', 'darwin']:
             iddfile = os.path.join(self.EP_DIR, 'ep8.9_{}/Energy+.idd'.format(self.system))
-        try:
-            IDF.setiddname(iddfile)
-        except IDDAlreadySetError:
-            pass
+        set_idd(iddfile)
 
         # Change some of the existing attributes if necessary (probably not)
         #self.features[0].setAttribute(1, "text")
@@ -1897,13 +1918,11 @@ class SimstockQGIS:
 
 
         # Set up Eppy
-        from eppy.modeleditor import IDF, IDDAlreadySetError
+        from eppy.modeleditor import IDF
+        from simstockidd import set_idd
         if self.system in ['windows', 'linux', 'darwin']:
             iddfile = os.path.join(self.EP_DIR, 'ep8.9_{}/Energy+.idd'.format(self.system))
-        try:
-            IDF.setiddname(iddfile)
-        except IDDAlreadySetError:
-            pass
+        set_idd(iddfile)
 
         # Initialise base idf which will be added to and become the basic_settings.idf for Simstock
         idf = IDF(os.path.join(self.plugin_dir, 'base.idf'))
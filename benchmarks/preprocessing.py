@@ -0,0 +1,160 @@
+"""
+/***************************************************************************
+ SimstockQGIS
+        copyright            : (C) 2023-2026 by UCL
+        email                : shyam.amrith.14@ucl.ac.uk
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+Benchmark of the preprocessing (simstockone) on synthetic terraced layers
+of growing size. The time per polygon should stay about flat as the layer
+grows. Run from the plugin directory:
+
+    python benchmarks/preprocessing.py [--terraces 25 50 100 200 400]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+import pandas as pd
+from shapely.geometry import Polygon
+
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules simstockone needs next to it, as in the plugin directory
+MODULES = ['simstockone.py', 'simstocktables.py']
+
+
+def terraced_layer(n_terraces, per_terrace=16, seed=3):
+    '''
+    Function which creates a layer of terraces of 'per_terrace' adjoining
+    houses, with some near-duplicate and collinear vertices and
+    anticlockwise polygons for the preprocessing to fix, and a courtyard
+    block with a hole, a block adjoining it and a detached house
+    '''
+    random.seed(seed)
+    rows = list()
+    x0, y0 = 1000.0, 2000.0
+
+    def add_row(polygon, height, nofloors, shading=False, wwr=25,
+                overhang_depth=0.0):
+        rows.append(dict(polygon=polygon.wkt, osgb='UID%03d' % len(rows),
+                         shading=shading, height=height, wwr=wwr,
+                         nofloors=nofloors,
+                         wall_const='wall_cavity_uninsulated',
+                         roof_const='roof_flat_uninsulated',
+                         floor_const='ground_floor_solid_uninsulated',
+                         glazing_const='glazing_uninsulated',
+                         infiltration_rate=0.7, ventilation_rate=2.0,
+                         overhang_depth=overhang_depth))
+
+    for t in range(n_terraces):
+        y = y0 + t * 14.0
+        xs = [x0 + (t % 3) * 2.3]
+        for _ in range(per_terrace):
+            xs.append(round(xs[-1] + random.choice([4.5, 5.0, 5.5, 6.1]), 2))
+        depth = 8.0
+        for k in range(per_terrace):
+            a, b = xs[k], xs[k + 1]
+            # Clockwise ring
+            ring = [(a, y), (a, y + depth), (b, y + depth), (b, y)]
+            r = random.random()
+            if r < 0.15:
+                # Near-duplicate vertex, which has to be simplified
+                ring.insert(2, (round(a + 0.05, 2), y + depth))
+            elif r < 0.3:
+                # Collinear vertex on the front wall
+                ring.insert(4, (round((a + b) / 2, 2), y))
+            if random.random() < 0.2:
+                # Anticlockwise ring, which has to be reversed
+                ring = ring[::-1]
+            nofloors = random.choice([1, 2, 3, 4])
+            add_row(Polygon(ring), 3.0 * nofloors, nofloors,
+                    shading=random.random() < 0.1,
+                    wwr=random.choice([12, 25, 40]),
+                    overhang_depth=random.choice([0.0, 0.5, float('nan')]))
+
+    # Courtyard block, a block sharing its east wall and a detached house
+    cx, cy = x0 + 80, y0
+    outer = [(cx, cy), (cx, cy + 30), (cx + 30, cy + 30), (cx + 30, cy)]
+    inner = [(cx + 10, cy + 10), (cx + 20, cy + 10), (cx + 20, cy + 20),
+             (cx + 10, cy + 20)]
+    add_row(Polygon(outer, [inner]), 9.0, 3)
+    add_row(Polygon([(cx + 30, cy + 5), (cx + 30, cy + 25), (cx + 40, cy + 25),
+                     (cx + 40, cy + 5)]), 6.0, 2)
+    add_row(Polygon([(cx + 60, cy), (cx + 60, cy + 8), (cx + 68, cy + 8),
+                     (cx + 68, cy)]), 3.0, 1)
+
+    df = pd.DataFrame(rows)
+    for i in range(int(df['nofloors'].max())):
+        df['FLOOR_{}: use'.format(i + 1)] = ['dwell' if i < n else None
+                                             for n in df['nofloors']]
+    return df
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def time_preprocessing(df, work_dir):
+    '''
+    Function which runs simstockone on the layer in a copy of the modules in
+    'work_dir' (it reads and writes its files next to itself) and returns
+    the time it took in seconds. Each run gets a new python process
+    '''
+    for module in MODULES:
+        shutil.copy(os.path.join(PLUGIN_DIR, module), work_dir)
+    with open(os.path.join(PLUGIN_DIR, 'config.json'), 'r') as read_file:
+        config = json.load(read_file)
+    # Single core, to time the preprocessing itself
+    config['Preprocessing cores'] = '1'
+    config['Preprocessed csv export'] = 'false'
+    with open(os.path.join(work_dir, 'config.json'), 'w') as write_file:
+        json.dump(config, write_file, indent=4)
+    df.to_csv(os.path.join(work_dir, 'sa_data.csv'))
+
+    script = ('import io, time, contextlib, simstockone\n'
+              'start = time.time()\n'
+              'with contextlib.redirect_stdout(io.StringIO()):\n'
+              '    simstockone.main()\n'
+              'print(time.time() - start)\n')
+    out = subprocess.run([sys.executable, '-c', script], cwd=work_dir,
+                         capture_output=True, text=True, check=True)
+    return float(out.stdout.split()[-1])
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--terraces', type=int, nargs='+',
+                        default=[25, 50, 100, 200, 400],
+                        help='Numbers of terraces of the benchmark layers')
+    args = parser.parse_args()
+
+    print('  polygons        s   ms/polygon', flush=True)
+    for n_terraces in args.terraces:
+        df = terraced_layer(n_terraces)
+        with tempfile.TemporaryDirectory() as work_dir:
+            seconds = time_preprocessing(df, work_dir)
+        print('{:10d} {:8.2f} {:12.2f}'.format(len(df), seconds,
+                                               1000 * seconds / len(df)),
+              flush=True)
+
+# END OF MAIN  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+if __name__ == '__main__':
+    main()
@@ -28,6 +28,8 @@ from eppy.idfreader import convertafield
 from eppy.idfreader import makeabunch
 from eppy.runner.run_functions import run
 from eppy.runner.run_functions import wrapped_help_text
+import eppy.bunchhelpers as bunchhelpers
+from eppy.bunch_subclass import BadEPFieldError
 
 
 class NoObjectError(Exception):
@@ -759,6 +761,79 @@ class IDF(object):
             abunch[k] = v
         return abunch
 
+    def newidfobjects(self, key, records, defaultvalues=True):
+        """
+        Add several new idfobjects of the same type to the model. This is the
+        bulk version of newidfobject: the default values are worked out once
+        and the field values are put straight into each new object.
+
+        For example ::
+
+            newidfobjects("ZONE", [{"Name": "Zone_1"}, {"Name": "Zone_2"}])
+            newidfobjects("ZONE", [("Zone_1", 0), ("Zone_2", 90)])
+
+        Parameters
+        ----------
+        key : str
+            The type of IDF object.
+        records : list of dicts or tuples
+            The field values of each object, either as a dict in the format
+            `{field: value}` or as a tuple of the values in field order
+            (starting after the key). Extensible fields such as the vertices
+            of a surface can only go up to the fields listed in the IDD.
+        defaultvalues: boolean
+            default is True. If True default values WILL be set.
+            If False, default values WILL NOT be set
+
+        Returns
+        -------
+        list of EpBunch objects
+
+        """
+        records = list(records)
+        if not records:
+            return []
+        key = key.upper()
+        key_i = self.model.dtls.index(key)
+
+        # this version can not add fields to the IDD
+        n = max(len(record) for record in records) - (
+            len(self.idd_info[key_i]) - 1
+        )  # the IDD has a placeholder for key. So subtract 1
+        if n > 0:
+            raise BadEPFieldError("%s has %s fields too many" % (key, n))
+
+        template = newrawobject(
+            self.model,
+            self.idd_info,
+            key,
+            block=self.block,
+            defaultvalues=defaultvalues,
+        )
+        objfields = [comm.get("field") for comm in self.idd_info[key_i]]
+        positions = {
+            bunchhelpers.makefieldname(field[0]): i
+            for i, field in enumerate(objfields)
+            if i > 0
+        }
+
+        abunches = []
+        for record in records:
+            obj = list(template)
+            if isinstance(record, dict):
+                try:
+                    values = [(positions[k], v) for k, v in record.items()]
+                except KeyError as e:
+                    raise BadEPFieldError("unable to find field %s" % (e.args[0],))
+            else:
+                values = enumerate(record, start=1)
+            for i, v in values:
+                extendlist(obj, i)
+                obj[i] = v
+            abunches.append(obj2bunch(self.model, self.idd_info, obj))
+        self.idfobjects[key].extend(abunches)
+        return abunches
+
     def popidfobject(self, key, index):
         """Pop an IDF object from the IDF.
 
@@ -21,8 +21,22 @@ import platform
 import subprocess
 import argparse
 import json
-import pandas as pd
 import sys
+import time
+import heapq
+import hashlib
+import shutil
+import io
+import zlib
+import zipfile
+import threading
+import urllib.request
+import urllib.error
+from urllib.parse import urlencode, urlparse, parse_qsl
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import namedtuple, deque, Counter
+import numpy as np
+from simstocktables import read_table
 
 # Add psutil location to path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "eppy-scripts"))
@@ -30,10 +44,55 @@ try:
     import psutil as pu
 except:
     pass
+from simstockjobs import (ledger_file, resume_jobs, queue_jobs, start_job, finish_job,
+                          runtime_history, COUNT_COLUMNS)
+from simstockprocess import resolve_executable
+
+# Idf objects counted to estimate the simulation time of an idf (their names
+# are the count columns of the ledger history)
+COST_OBJECTS = {"ZONE": "zones", "BUILDINGSURFACE:DETAILED": "surfaces",
+                "WINDOW": "windows", "SHADING:BUILDING:DETAILED": "shading"}
+# Seconds per object used until enough simulation times have been recorded
+DEFAULT_COSTS = {"intercept": 2.0, "zones": 1.0, "surfaces": 0.02,
+                 "windows": 0.02, "shading": 0.005}
+# Number of the latest simulation times in the ledger used to calibrate the
+# cost model
+MAX_RECORDED_RUNS = 1000
+
+# What a worker process needs to simulate idfs. The settings are the same for
+# every job and are sent once to each worker by the pool initializer, a job
+# is only the idf and its output directory. Neither holds any table, so
+# sending a job to a worker costs next to nothing
+EPSettings = namedtuple("EPSettings", ["idf_dir", "epw_file", "energyplusexe", "readvarseso",
+                                       "cache_dir", "ledger"])
+EPJob = namedtuple("EPJob", ["idf_file", "output_dir", "key"])
+# Settings of the worker process, set by init_worker
+worker_settings = None
+
+# ReadVarsESO settings, which are part of the key of the cached results
+RVI_TEXT = "eplusout.eso\neplusout.csv\n0"
+RVI_FREQUENCY = "unlimited"
+# Result files kept in the simulation cache (those read by the plugin)
+CACHE_FILES = ["eplusout.csv", "eplusout.err"]
+
+# Distributed runs: workers poll the coordinator for a job every
+# POLL_INTERVAL s and send a heartbeat every HEARTBEAT_INTERVAL s while
+# simulating. A job whose worker has not been heard of for LEASE_TIMEOUT s
+# is handed out again, at most MAX_ATTEMPTS times. A worker gives up when
+# the coordinator cannot be reached for WORKER_TIMEOUT s
+POLL_INTERVAL = 2
+HEARTBEAT_INTERVAL = 10
+LEASE_TIMEOUT = 60
+MAX_ATTEMPTS = 3
+WORKER_TIMEOUT = 60
 
 parser = argparse.ArgumentParser()
 parser.add_argument("cwd", help="The path to the user cwd")
 parser.add_argument("--singlecore", action="store_true", help="If specified, simulation will use single core")
+parser.add_argument("--serve", metavar="HOST:PORT",
+                    help="If specified, the simulations are handed out to workers connecting to this address")
+parser.add_argument("--worker", metavar="URL",
+                    help="If specified, run as a worker of the coordinator at this url (cwd is the work directory)")
 args = parser.parse_args()
 
 class EP_Run():
@@ -42,8 +101,9 @@ class EP_Run():
         self.EP_DIR = os.path.join(self.plugin_dir, "EnergyPlus")
         self.cwd = cwd
         self.idf_dir = os.path.join(cwd, "idf_files")
-        self.preprocessed_df = pd.read_csv(os.path.join(self.plugin_dir, "sa_preprocessed.csv"))
-        self.idf_files = [os.path.join(self.idf_dir, f"{bi}.idf") for bi in self.preprocessed_df[self.preprocessed_df["shading"]==False]["bi"].unique()]
+        # The idfs created by simstocktwo (a large BI can be split into several)
+        self.idf_table = read_table(self.plugin_dir, "sa_idf_files", columns=["idf"])
+        self.idf_files = [os.path.join(self.idf_dir, f"{idf}.idf") for idf in self.idf_table["idf"]]
 
         # Load config file
         with open(os.path.join(self.plugin_dir, "config.json"), "r") as read_file:
@@ -51,71 +111,566 @@ class EP_Run():
         self.epw_file = os.path.join(self.cwd, self.config["epw"])
         
         # Find the computer's operating system and find energyplus version
-        system = platform.system().lower()
-        if system in ['windows', 'linux', 'darwin']:
-            self.energyplusexe = os.path.join(self.EP_DIR, 'ep8.9_{}/energyplus'.format(system))
-            self.readvarseso   = os.path.join(self.EP_DIR, 'ep8.9_{}/ReadVarsESO'.format(system))
-
-
-    def run_ep(self, idf_file):
-        output_dir = idf_file[:-4]
-        output_path = os.path.join(self.idf_dir, output_dir)
-
-        # Delete existing results csv
-        if os.path.exists(os.path.join(output_path, "eplusout.csv")):
-            os.remove(os.path.join(output_path, "eplusout.csv"))
-
-        # Same for eso file
-        if os.path.exists(os.path.join(output_path, "eplusout.eso")):
-            os.remove(os.path.join(output_path, "eplusout.eso"))
-
-        # Run the EnergyPlus simulation
-        out = subprocess.run([self.energyplusexe, '-d', output_dir, '-w', self.epw_file, idf_file],
-                             cwd = self.idf_dir, capture_output=True, text=True) #no readvarseso
-        if out.returncode != 0:
-            return os.path.join(output_path, 'eplusout.err')
-            #raise RuntimeError(f"EnergyPlus simulation of {output_dir} failed.\n"
-            #                   f"Check the EnergyPlus err file '{os.path.join(output_path, 'eplusout.err')}'")
-        
-        # Generate the .rvi file
-        self.generate_rvi(output_path)
-        
-        # Call ReadVarsESO to produce the results csv
-        self.run_readvarseso(output_path)
+        self.energyplusexe, self.readvarseso = energyplus_executables(self.EP_DIR)
 
 
-    @staticmethod
-    def generate_rvi(output_path):
-        with open (os.path.join(output_path, "results-rvi.rvi"), "w") as f:
-            f.write("eplusout.eso\neplusout.csv\n0")
 
+        # Results of unchanged simulations are reused from the cache in the cwd
+        self.cache_size = float(self.config.get("Simulation cache size - MB", 0)) * 1e6
+        self.cache_dir = os.path.join(self.cwd, "ep_cache") if self.cache_size > 0 else None
+        # The state of each simulation is kept in a ledger in the cwd, so that
+        # an interrupted run can be resumed
+        self.ledger = ledger_file(self.cwd)
+        self.settings = EPSettings(self.idf_dir, self.epw_file, self.energyplusexe,
+                                   self.readvarseso, self.cache_dir, self.ledger)
 
-    def run_readvarseso(self, output_path):
-        subprocess.run([self.readvarseso, "results-rvi.rvi", "unlimited"], cwd=output_path)
+
+    def jobs(self):
+        """
+        The job descriptors of the idfs which have to be simulated. Idfs done
+        in an interrupted run or being simulated by another process are left
+        out, and the results of the idfs found in the cache are copied to
+        their output directory instead.
+        """
+        settings_key = simulation_settings_key(self.settings)
+        all_jobs = [EPJob(idf_file, idf_file[:-4], results_key(idf_file, settings_key))
+                    for idf_file in self.idf_files]
+        keys = {job_name(job): job.key for job in all_jobs}
+
+        # Resume an interrupted run, unless the results have gone since
+        done, running = resume_jobs(self.ledger, keys)
+        done = {job_name(job) for job in all_jobs if job_name(job) in done and
+                os.path.exists(os.path.join(self.idf_dir, job.output_dir, "eplusout.csv"))}
+        queue_jobs(self.ledger, keys, done | running)
+
+        jobs, n_cached = [], 0
+        for job in all_jobs:
+            if job_name(job) in done | running:
+                continue
+            if self.cache_dir is not None and restore_results(self.settings, job):
+                finish_job(self.ledger, job_name(job), 0)
+                n_cached += 1
+            else:
+                jobs.append(job)
+        if n_cached:
+            print(f"Reusing the cached results of {n_cached} of {len(self.idf_files)} idfs")
+        return jobs
 
 
     def run_ep_multi(self, cores):
-        p = mp.Pool(cores)
-        errs = p.map(self.run_ep, self.idf_files)
+        # Longest predicted simulation first, so that a large BI does not
+        # start last and leave the other cores idle
+        jobs = self.jobs()
+        if not jobs:
+            return []
+        counts = {job.idf_file: idf_counts(job.idf_file) for job in jobs}
+        predicted = self.predict_runtimes(counts)
+        jobs.sort(key=lambda job: -predicted[job.idf_file])
+        predicted_makespan = schedule_makespan([predicted[job.idf_file] for job in jobs], cores)
+
+        start = time.time()
+        errs = []
+        p = mp.Pool(cores, initializer=init_worker, initargs=(self.settings,))
+        for job, exit_code, err, runtime in p.imap_unordered(run_job, jobs, chunksize=1):
+            finish_job(self.ledger, job_name(job), exit_code, runtime, counts[job.idf_file])
+            errs.append(err)
         p.close()
+        makespan = time.time() - start
+
+        print(f"Simulated {len(jobs)} idfs on {cores} cores: predicted makespan "
+              f"{predicted_makespan:.1f}s, actual {makespan:.1f}s")
         return errs
 
 
     def run_ep_single(self):
         errs = []
-        for i, idf_file in enumerate(self.idf_files):
-            print(f"Starting simulation {i+1} of {len(self.idf_files)}")
-            errs.append(self.run_ep(idf_file))
+        init_worker(self.settings)
+        jobs = self.jobs()
+        for i, job in enumerate(jobs):
+            print(f"Starting simulation {i+1} of {len(jobs)}")
+            job, exit_code, err, runtime = run_job(job)
+            finish_job(self.ledger, job_name(job), exit_code, runtime, idf_counts(job.idf_file))
+            errs.append(err)
         return errs
 
 
+    def run_ep_distributed(self, address):
+        """
+        Serves the simulations to workers (mptest --worker) on this or other
+        computers and writes back their results.
+        """
+        jobs = self.jobs()
+        if not jobs:
+            return []
+        counts = {job.idf_file: idf_counts(job.idf_file) for job in jobs}
+        predicted = self.predict_runtimes(counts)
+        jobs.sort(key=lambda job: -predicted[job.idf_file])
+
+        coordinator = Coordinator(self.settings, jobs, counts)
+        host, port = address.rsplit(":", 1)
+        server = ThreadingHTTPServer((host, int(port)), coordinator_handler(coordinator))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Serving {len(jobs)} simulation jobs on http://{host}:{port}", flush=True)
+
+        start = time.time()
+        coordinator.wait()
+        print(f"Simulated {len(jobs)} idfs on workers in {time.time() - start:.1f}s", flush=True)
+        # Leave the workers time to find out that there are no jobs left
+        time.sleep(2 * POLL_INTERVAL)
+        server.shutdown()
+        server.server_close()
+        return list(coordinator.finished.values())
+
+
+    def predict_runtimes(self, counts):
+        """
+        Estimates the simulation time (s) of each idf from its object counts. The
+        cost model is a linear fit of the simulation times in the ledger history,
+        or the default costs until enough of them have been recorded.
+        """
+        columns = list(COUNT_COLUMNS)
+        costs = dict(DEFAULT_COSTS)
+        history = np.array(runtime_history(self.ledger, MAX_RECORDED_RUNS), dtype=float)
+        if len(history) > 2 * len(columns):
+            x = np.column_stack([np.ones(len(history)), history[:, :-1]])
+            fit = np.linalg.lstsq(x, history[:, -1], rcond=None)[0]
+            costs = dict(zip(["intercept"] + columns, np.clip(fit, 0, None).tolist()))
+        else:
+            print("Not enough recorded simulation times, using the default cost model")
+        return {idf_file: max(costs["intercept"] + sum(costs[c] * n for c, n in count.items()), 0.1)
+                for idf_file, count in counts.items()}
+
+
+    def prune_cache(self):
+        """Removes the least recently used cached results above the cache size."""
+        if self.cache_dir is None or not os.path.isdir(self.cache_dir):
+            return
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            entry = os.path.join(self.cache_dir, key)
+            if os.path.isdir(entry):
+                size = sum(f.stat().st_size for f in os.scandir(entry))
+                entries.append((os.path.getmtime(entry), size, entry))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.cache_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+
+class Coordinator():
+    """
+    Queue of the jobs of a distributed run. Jobs are leased to workers, and
+    handed out again when their worker stops sending heartbeats.
+    """
+    def __init__(self, settings, jobs, counts):
+        self.settings = settings
+        self.jobs = {job_name(job): job for job in jobs}
+        # Idf file: object counts, recorded with the simulation times
+        self.counts = counts
+        self.queue = deque(self.jobs)
+        # Job name: [worker, time of the last heartbeat]
+        self.leases = {}
+        self.attempts = Counter()
+        # Job name: error (None if the simulation succeeded)
+        self.finished = {}
+        self.lock = threading.Lock()
+        with open(settings.epw_file, "rb") as f:
+            self.epw = f.read()
+
+
+    def lease(self, worker):
+        """The next job for a worker, as (http status, compressed job)."""
+        with self.lock:
+            self.requeue_expired()
+            if not self.queue:
+                # Wait for the leased jobs or stop, when all are finished
+                return (204, b"") if self.leases else (410, b"")
+            name = self.queue.popleft()
+            self.leases[name] = [worker, time.time()]
+            self.attempts[name] += 1
+            start_job(self.settings.ledger, name, os.getpid(), time.time())
+        job = self.jobs[name]
+        with open(job.idf_file, "r", encoding="latin-1") as f:
+            idf = f.read()
+        return 200, zlib.compress(json.dumps({"name": name, "key": job.key, "idf": idf}).encode())
+
+
+    def heartbeat(self, name):
+        with self.lock:
+            if name not in self.leases:
+                return 410
+            self.leases[name][1] = time.time()
+            return 200
+
+
+    def result(self, name, exit_code, runtime, data):
+        """Writes the zipped results of a job to its output directory."""
+        with self.lock:
+            if name not in self.jobs or name in self.finished:
+                return 200
+            self.leases.pop(name, None)
+            if name in self.queue:
+                self.queue.remove(name)
+
+            job = self.jobs[name]
+            output_path = os.path.join(self.settings.idf_dir, job.output_dir)
+            os.makedirs(output_path, exist_ok=True)
+            for result_file in ["eplusout.csv", "eplusout.eso"]:
+                if os.path.exists(os.path.join(output_path, result_file)):
+                    os.remove(os.path.join(output_path, result_file))
+            # Only the expected result files are written
+            with zipfile.ZipFile(io.BytesIO(data)) as results:
+                for result_file in set(results.namelist()) & set(CACHE_FILES):
+                    with open(os.path.join(output_path, result_file), "wb") as f:
+                        f.write(results.read(result_file))
+
+            err = None
+            if exit_code != 0:
+                err = os.path.join(output_path, "eplusout.err")
+            elif self.settings.cache_dir is not None:
+                store_results(self.settings, job)
+            finish_job(self.settings.ledger, name, exit_code, runtime, self.counts[job.idf_file])
+            self.finished[name] = err
+        return 200
+
+
+    def requeue_expired(self):
+        """Hands out again the jobs of the workers which stopped sending heartbeats."""
+        now = time.time()
+        for name, (worker, heartbeat) in list(self.leases.items()):
+            if now - heartbeat < LEASE_TIMEOUT:
+                continue
+            del self.leases[name]
+            if self.attempts[name] < MAX_ATTEMPTS:
+                print(f"Worker {worker} lost, {name} queued again", flush=True)
+                self.queue.appendleft(name)
+            else:
+                print(f"{name} failed on {MAX_ATTEMPTS} workers", flush=True)
+                output_path = os.path.join(self.settings.idf_dir, self.jobs[name].output_dir)
+                finish_job(self.settings.ledger, name, None)
+                self.finished[name] = os.path.join(output_path, "eplusout.err")
+
+
+    def wait(self):
+        """Waits until every job is finished."""
+        while True:
+            with self.lock:
+                self.requeue_expired()
+                if len(self.finished) == len(self.jobs):
+                    return
+            time.sleep(1)
+
+
+def coordinator_handler(coordinator):
+    """
+    Http request handler of a coordinator: GET /epw and /job?worker= to
+    fetch the weather file and a job, POST /heartbeat?job= and
+    /result?job=&exit_code=&seconds= with the zipped result files.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path, query = self.parse()
+            if path == "/epw":
+                self.reply(200, coordinator.epw)
+            elif path == "/job":
+                self.reply(*coordinator.lease(query.get("worker", self.client_address[0])))
+            else:
+                self.reply(404)
+
+        def do_POST(self):
+            path, query = self.parse()
+            data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if path == "/heartbeat":
+                self.reply(coordinator.heartbeat(query.get("job")))
+            elif path == "/result":
+                self.reply(coordinator.result(query.get("job"), int(query["exit_code"]),
+                                              float(query["seconds"]), data))
+            else:
+                self.reply(404)
+
+        def parse(self):
+            url = urlparse(self.path)
+            return url.path, dict(parse_qsl(url.query))
+
+        def reply(self, status, data=b""):
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def request(url, path, query=None, data=None):
+    """Sends a request to the coordinator and returns the http status and body."""
+    full_url = url.rstrip("/") + path + ("?" + urlencode(query) if query else "")
+    try:
+        with urllib.request.urlopen(full_url, data=data, timeout=60) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as err:
+        return err.code, b""
+
+
+def run_worker(url, work_dir):
+    """
+    Simulates the jobs of the coordinator at 'url' with the E+ of this
+    plugin, until the coordinator has no jobs left.
+    """
+    worker = f"{platform.node()}-{os.getpid()}"
+    work_dir = os.path.join(work_dir, f"worker_{os.getpid()}")
+    os.makedirs(work_dir, exist_ok=True)
+    energyplusexe, readvarseso = energyplus_executables(os.path.join(os.path.dirname(__file__), "EnergyPlus"))
+    settings = EPSettings(work_dir, os.path.join(work_dir, "weather.epw"), energyplusexe,
+                          readvarseso, None, None)
+
+    unreachable = None
+    while True:
+        try:
+            if not os.path.exists(settings.epw_file):
+                status, epw = request(url, "/epw")
+                if status != 200:
+                    raise OSError(f"No weather file from {url}")
+                with open(settings.epw_file, "wb") as f:
+                    f.write(epw)
+            status, data = request(url, "/job", {"worker": worker})
+        except OSError:
+            # The coordinator may be starting or gone
+            unreachable = unreachable or time.time()
+            if time.time() - unreachable > WORKER_TIMEOUT:
+                break
+            time.sleep(POLL_INTERVAL)
+            continue
+        unreachable = None
+        if status == 410:
+            break
+        if status != 200:
+            time.sleep(POLL_INTERVAL)
+            continue
+
+        payload = json.loads(zlib.decompress(data))
+        name = os.path.basename(payload["name"])
+        idf_file = os.path.join(work_dir, name)
+        with open(idf_file, "w", encoding="latin-1") as f:
+            f.write(payload["idf"])
+        job = EPJob(idf_file, idf_file[:-4], payload["key"])
+        print(f"Simulating {name}", flush=True)
+
+        # Tell the coordinator that the worker is alive while E+ runs
+        stop = threading.Event()
+        def send_heartbeats():
+            while not stop.wait(HEARTBEAT_INTERVAL):
+                try:
+                    request(url, "/heartbeat", {"job": name}, b"")
+                except OSError:
+                    pass
+        threading.Thread(target=send_heartbeats, daemon=True).start()
+        start = time.time()
+        exit_code, err = run_ep(settings, job)
+        runtime = time.time() - start
+        stop.set()
+
+        # Send the compressed result files back
+        output_path = os.path.join(work_dir, job.output_dir)
+        results = io.BytesIO()
+        with zipfile.ZipFile(results, "w", zipfile.ZIP_DEFLATED) as z:
+            for result_file in CACHE_FILES:
+                if os.path.exists(os.path.join(output_path, result_file)):
+                    z.write(os.path.join(output_path, result_file), result_file)
+        try:
+            request(url, "/result", {"job": name, "exit_code": exit_code,
+                                     "seconds": runtime}, results.getvalue())
+        except OSError:
+            # The coordinator will hand out the job again
+            pass
+        shutil.rmtree(output_path, ignore_errors=True)
+        os.remove(idf_file)
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def energyplus_executables(ep_dir):
+    """
+    The E+ and ReadVarsESO executables for the computer's operating system,
+    with '.exe' on Windows. A missing executable is returned as is, so that
+    running it fails with the path in the error.
+    """
+    system = platform.system().lower()
+    if system in ['windows', 'linux', 'darwin']:
+        executables = [os.path.join(ep_dir, 'ep8.9_{}'.format(system), name)
+                       for name in ['energyplus', 'ReadVarsESO']]
+        return tuple(resolve_executable(exe) or exe for exe in executables)
+    return None, None
+
+
+def init_worker(settings):
+    """Keeps the settings of the simulations in the worker process."""
+    global worker_settings
+    worker_settings = settings
+
+
+def job_name(job):
+    """The name of the job of an idf in the ledger."""
+    return os.path.basename(job.idf_file)
+
+
+def run_job(job):
+    """Runs the simulation of a job and returns the job, E+ exit code, error and runtime."""
+    start = time.time()
+    start_job(worker_settings.ledger, job_name(job), os.getpid(), start)
+    exit_code, err = run_ep(worker_settings, job)
+    if err is None and worker_settings.cache_dir is not None:
+        store_results(worker_settings, job)
+    return job, exit_code, err, time.time() - start
+
+
+def run_ep(settings, job):
+    output_path = os.path.join(settings.idf_dir, job.output_dir)
+
+    # Delete existing results csv
+    if os.path.exists(os.path.join(output_path, "eplusout.csv")):
+        os.remove(os.path.join(output_path, "eplusout.csv"))
+
+    # Same for eso file
+    if os.path.exists(os.path.join(output_path, "eplusout.eso")):
+        os.remove(os.path.join(output_path, "eplusout.eso"))
+
+    # Run the EnergyPlus simulation
+    out = subprocess.run([settings.energyplusexe, '-d', job.output_dir, '-w', settings.epw_file, job.idf_file],
+                         cwd = settings.idf_dir, capture_output=True, text=True) #no readvarseso
+    if out.returncode != 0:
+        return out.returncode, os.path.join(output_path, 'eplusout.err')
+        #raise RuntimeError(f"EnergyPlus simulation of {job.output_dir} failed.\n"
+        #                   f"Check the EnergyPlus err file '{os.path.join(output_path, 'eplusout.err')}'")
+
+    # Generate the .rvi file
+    generate_rvi(output_path)
+
+    # Call ReadVarsESO to produce the results csv
+    run_readvarseso(settings, output_path)
+    return 0, None
+
+
+def generate_rvi(output_path):
+    with open (os.path.join(output_path, "results-rvi.rvi"), "w") as f:
+        f.write(RVI_TEXT)
+
+
+def run_readvarseso(settings, output_path):
+    subprocess.run([settings.readvarseso, "results-rvi.rvi", RVI_FREQUENCY], cwd=output_path)
+
+
+def simulation_settings_key(settings):
+    """
+    Hash of what the results depend on besides the idf: the epw contents and
+    the ReadVarsESO settings, and with the cache on the E+ version (its
+    directory, size and date of the executable). The ledger only uses the
+    key to tell whether an idf of an interrupted run has changed, for which
+    the E+ executable does not matter.
+    """
+    digest = hashlib.sha256()
+    with open(settings.epw_file, "rb") as f:
+        digest.update(f.read())
+    digest.update(f"{RVI_TEXT}\n{RVI_FREQUENCY}".encode())
+    if settings.cache_dir is not None and settings.energyplusexe and os.path.isfile(settings.energyplusexe):
+        exe = os.stat(settings.energyplusexe)
+        version = os.path.basename(os.path.dirname(settings.energyplusexe))
+        digest.update(f"\n{version}\n{exe.st_size}\n{exe.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+
+def results_key(idf_file, settings_key):
+    """
+    Key of the cached results of an idf. The idf text is hashed without its
+    line endings and without the line endings comment of its first line,
+    which depend on the system which wrote it.
+    """
+    with open(idf_file, "rb") as f:
+        lines = f.read().splitlines()
+    if lines and lines[0].startswith(b"!-") and b"Line endings" in lines[0]:
+        lines = lines[1:]
+    digest = hashlib.sha256(settings_key.encode())
+    digest.update(b"\n".join(line.rstrip() for line in lines))
+    return digest.hexdigest()
+
+
+def restore_results(settings, job):
+    """Copies the cached results of a job to its output directory, if cached."""
+    entry = os.path.join(settings.cache_dir, job.key)
+    if not os.path.isdir(entry):
+        return False
+    output_path = os.path.join(settings.idf_dir, job.output_dir)
+    os.makedirs(output_path, exist_ok=True)
+    # The eso of an earlier simulation would not match the restored csv
+    if os.path.exists(os.path.join(output_path, "eplusout.eso")):
+        os.remove(os.path.join(output_path, "eplusout.eso"))
+    for name in CACHE_FILES:
+        shutil.copyfile(os.path.join(entry, name), os.path.join(output_path, name))
+    # Last use, for removing the least recently used results
+    os.utime(entry)
+    return True
+
+
+def store_results(settings, job):
+    """
+    Adds the results of a job to the cache. They are copied to a temporary
+    directory which is then renamed, so that the cache never holds partial
+    results.
+    """
+    output_path = os.path.join(settings.idf_dir, job.output_dir)
+    if any(not os.path.exists(os.path.join(output_path, name)) for name in CACHE_FILES):
+        return
+    entry = os.path.join(settings.cache_dir, job.key)
+    temporary_entry = f"{entry}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(temporary_entry, exist_ok=True)
+        for name in CACHE_FILES:
+            shutil.copyfile(os.path.join(output_path, name), os.path.join(temporary_entry, name))
+        os.replace(temporary_entry, entry)
+    except OSError:
+        # Another process has cached the same results
+        shutil.rmtree(temporary_entry, ignore_errors=True)
+
+
+def idf_counts(idf_file):
+    """Counts the objects of an idf which the simulation time depends on."""
+    count = dict.fromkeys(COST_OBJECTS.values(), 0)
+    with open(idf_file, "r", encoding="latin-1") as f:
+        for line in f:
+            key = line.strip().rstrip(",").upper()
+            if key in COST_OBJECTS and line.rstrip().endswith(","):
+                count[COST_OBJECTS[key]] += 1
+    return count
+
+
+def schedule_makespan(runtimes, cores):
+    """Makespan of running the jobs in the given order, each on the first free core."""
+    cores_free = [0.0] * max(min(cores, len(runtimes)), 1)
+    for runtime in runtimes:
+        heapq.heappush(cores_free, heapq.heappop(cores_free) + runtime)
+    return max(cores_free)
+
+
 
 def main():
     cwd = args.cwd
+
+    # Worker of a distributed run
+    if args.worker:
+        run_worker(args.worker, cwd)
+        return
+
     runner = EP_Run(cwd)
 
+    # Distributed simulation
+    if args.serve:
+        errs = runner.run_ep_distributed(args.serve)
+
     # Single-core simulation
-    if args.singlecore:
+    elif args.singlecore:
         errs = runner.run_ep_single()
     
     # Multi-core simulation
@@ -127,6 +682,7 @@ def main():
         errs = runner.run_ep_multi(cores)
 
     errs = [e for e in errs if e is not None]
+    runner.prune_cache()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,118 @@
+"""
+/***************************************************************************
+ SimstockQGIS
+        copyright            : (C) 2023-2026 by UCL
+        email                : shyam.amrith.14@ucl.ac.uk
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import os
+import gc
+import pickle
+import hashlib
+import eppy
+from eppy.modeleditor import IDF, IDDAlreadySetError
+from eppy.idfreader import iddversiontuple
+from eppy.EPlusInterfaceFunctions import parse_idd
+
+# Increase when the content of the cache file changes
+IDD_CACHE_VERSION = 1
+
+
+def set_idd(iddfile):
+    '''
+    Function which sets the E+ idd file used by eppy. Parsing the idd takes
+    about a second, so the parsed idd is kept in a cache file next to it and
+    loaded from there when the idd has not changed
+    '''
+    try:
+        IDF.setiddname(iddfile)
+    except IDDAlreadySetError:
+        return
+    # Nothing to do if the idd has already been parsed in this process
+    if IDF.idd_info is not None:
+        return
+
+    cache_file = idd_cache_file(iddfile)
+    key = idd_key(iddfile)
+    data = load_idd_cache(cache_file, key)
+    if data is None:
+        block, _, commdct, idd_index = parse_idd.extractidddata(iddfile)
+        data = (block, commdct, idd_index)
+        save_idd_cache(cache_file, key, data)
+    block, commdct, idd_index = data
+    IDF.setidd(commdct, idd_index, block, iddversiontuple(iddfile))
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def idd_cache_file(iddfile):
+    '''
+    Function which returns the path of the cache of the parsed idd. Each
+    eppy version has its own cache
+    '''
+    return '{}_eppy{}.pkl'.format(os.path.splitext(iddfile)[0], eppy.__version__)
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def idd_key(iddfile):
+    '''
+    Function which returns what the cache has to match to be used: the path,
+    size, modification time and hash of the idd file
+    '''
+    stat = os.stat(iddfile)
+    with open(iddfile, 'rb') as read_file:
+        digest = hashlib.sha256(read_file.read()).hexdigest()
+    return {'version': IDD_CACHE_VERSION, 'path': os.path.abspath(iddfile),
+            'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha256': digest}
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def load_idd_cache(cache_file, key):
+    '''
+    Function which loads the parsed idd from the cache. Returns None if the
+    cache is missing, unreadable or does not match the idd file
+    '''
+    # The parsed idd is a large number of small lists and dicts, which the
+    # garbage collector would otherwise keep scanning while they are loaded
+    gc.disable()
+    try:
+        with open(cache_file, 'rb') as read_file:
+            cache = pickle.load(read_file)
+    except Exception:
+        return None
+    finally:
+        gc.enable()
+    if not isinstance(cache, dict) or cache.get('key') != key:
+        return None
+    return cache['data']
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def save_idd_cache(cache_file, key, data):
+    '''
+    Function which writes the parsed idd to a temporary file and then
+    replaces the old cache, so that processes starting at the same time never
+    read a partially written cache
+    '''
+    temporary_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+    try:
+        with open(temporary_file, 'wb') as write_file:
+            pickle.dump({'key': key, 'data': data}, write_file, protocol=4)
+        os.replace(temporary_file, cache_file)
+    except OSError as err:
+        print('Idd cache could not be saved: {}'.format(err), flush=True)
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
@@ -0,0 +1,161 @@
+"""
+/***************************************************************************
+ SimstockQGIS
+        copyright            : (C) 2023-2026 by UCL
+        email                : shyam.amrith.14@ucl.ac.uk
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import os
+import platform
+from eppy.modeleditor import newrawobject
+from eppy.bunch_subclass import BadEPFieldError
+from eppy.bunchhelpers import makefieldname, scientificnotation
+
+# Only newer eppy versions (5.63) extend the idd for objects with more fields
+# than it lists
+try:
+    import eppy.ext_field_functions as extff
+except ImportError:
+    extff = None
+
+
+class IDFWriter():
+    '''
+    Idf backend which formats new objects straight into idf text instead of
+    creating eppy objects. The objects of the idf it is given (the basic
+    settings) stay in eppy and can still be edited or removed. New objects
+    are kept as text per object type, so that saveas writes the same file as
+    eppy's saveas would
+    '''
+
+    def __init__(self, idf):
+        self.idf = idf
+        self.idfobjects = idf.idfobjects
+        # Object type: list of formatted objects
+        self.objects = dict()
+        # Object type: (default values, field positions, field comments)
+        self.fields = dict()
+
+
+    def newidfobject(self, key, **fields):
+        '''
+        Function which adds an object of type 'key' with the given field
+        values (the same arguments as eppy's newidfobject)
+        '''
+        self.newidfobjects(key, [fields])
+
+
+    def newidfobjects(self, key, records):
+        '''
+        Function which adds objects of type 'key'. Each record holds the field
+        values of an object as a dict or as a tuple in field order (the same
+        arguments as newidfobjects of the bundled eppy)
+        '''
+        if not records:
+            return
+        key = key.upper()
+        n_fields = max(len(record) for record in records)
+        if key not in self.fields or (n_fields > len(self.fields[key][1])
+                                      and extff is not None):
+            self.add_fields(key, n_fields)
+        defaults, positions, comments = self.fields[key]
+        if n_fields > len(positions):
+            raise BadEPFieldError('{} has {} fields too many'.format(
+                key, n_fields - len(positions)))
+
+        objects = self.objects.setdefault(key, list())
+        for record in records:
+            obj = list(defaults)
+            if isinstance(record, dict):
+                try:
+                    values = [(positions[name], value)
+                              for name, value in record.items()]
+                except KeyError as err:
+                    raise BadEPFieldError('unknown field {}'.format(err.args[0]))
+            else:
+                values = enumerate(record, start=1)
+            for i, value in values:
+                if i >= len(obj):
+                    obj.extend([''] * (i - len(obj) + 1))
+                obj[i] = value
+            objects.append(idf_object_text(obj, comments))
+
+
+    def add_fields(self, key, n_fields):
+        '''
+        Function which reads the default values and field names of 'key' from
+        the idd. As in eppy, the idd is extended when there are more fields
+        than it lists (e.g. surfaces with many vertices) if eppy does
+        '''
+        idf = self.idf
+        key_i = idf.model.dtls.index(key)
+        n_idd = len(idf.idd_info[key_i]) - 1
+        if n_fields > n_idd and extff is not None:
+            extff.increaseIDDfields(idf.block, idf.idd_info, key_i, key,
+                                    n_fields - n_idd)
+        defaults = newrawobject(idf.model, idf.idd_info, key, block=idf.block)
+        names = [makefieldname(comm.get('field')[0])
+                 for comm in idf.idd_info[key_i][1:]]
+        positions = {name: i + 1 for i, name in enumerate(names)}
+        comments = [name.replace('_', ' ') for name in names]
+        self.fields[key] = (defaults, positions, comments)
+
+
+    def removeidfobject(self, idfobject):
+        '''
+        Function which removes an object of the basic settings
+        '''
+        self.idf.removeidfobject(idfobject)
+
+
+    def saveas(self, filename, encoding='latin-1'):
+        '''
+        Function which writes the idf with the default line endings of the
+        system, as eppy's saveas does
+        '''
+        text = ['!- {} Line endings \n'.format(platform.system())]
+        for key in self.idf.model.dtls:
+            for idfobject in self.idfobjects[key]:
+                text.append(idfobject.__repr__())
+            text.extend(self.objects.get(key, list()))
+        text = os.linesep.join(''.join(text).splitlines())
+        with open(filename, 'wb') as idf_out:
+            idf_out.write(text.encode(encoding))
+
+# END OF CLASS  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def idf_object_text(obj, comments):
+    '''
+    Function which formats the values of an idf object with its field
+    comments, in the same way as eppy prints an object
+    '''
+    lines = list()
+    for value in obj:
+        # Print integer values without decimals
+        try:
+            if int(value) == value:
+                value = int(value)
+        except ValueError:
+            pass
+        lines.append(value)
+    lines[0] = '{},'.format(lines[0])
+    for i, line in enumerate(lines[1:-1]):
+        # E+ cannot read wide numbers, convert to 1e+3
+        lines[i + 1] = '    {},'.format(scientificnotation(line, width=18))
+    lines[-1] = '    {};'.format(lines[-1])
+    lines = [lines[0]] + ['{}    !- {}'.format(line.ljust(26), comment)
+                          for line, comment in zip(lines[1:], comments)]
+    return '\n{}\n'.format('\n'.join(lines))
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
@@ -0,0 +1,191 @@
+"""
+/***************************************************************************
+ SimstockQGIS
+        copyright            : (C) 2023-2026 by UCL
+        email                : shyam.amrith.14@ucl.ac.uk
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import os
+import time
+import sqlite3
+from contextlib import contextmanager
+
+# psutil is bundled in eppy-scripts, which mptest adds to the path before
+# importing this module
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+# Idf object counts kept with each simulation time in the history, from
+# which mptest estimates the simulation time of an idf
+COUNT_COLUMNS = ('zones', 'surfaces', 'windows', 'shading')
+
+
+def ledger_file(cwd):
+    '''
+    Function which returns the path of the simulation job ledger in the cwd
+    '''
+    return os.path.join(cwd, 'ep_jobs.sqlite')
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+@contextmanager
+def ledger(path):
+    '''
+    Function which opens the ledger and creates its tables if needed. 'jobs'
+    holds the current state of the job of each idf and 'history' a row per
+    finished simulation with its runtime and idf object counts. The changes
+    are committed and the ledger closed at the end of the with block
+    '''
+    # Workers and the main process write to the ledger at the same time,
+    # each write waits for the others to finish
+    connection = sqlite3.connect(path, timeout=60)
+    connection.execute('CREATE TABLE IF NOT EXISTS jobs (idf TEXT PRIMARY KEY, '
+                       'key TEXT, status TEXT, pid INTEGER, queued REAL, '
+                       'started REAL, finished REAL, exit_code INTEGER)')
+    connection.execute('CREATE TABLE IF NOT EXISTS history (idf TEXT, key TEXT, '
+                       'started REAL, finished REAL, exit_code INTEGER, '
+                       'seconds REAL, {} INTEGER)'.format(
+                           ' INTEGER, '.join(COUNT_COLUMNS)))
+    try:
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def process_alive(pid, started):
+    '''
+    Function which checks whether the process which started a job at time
+    'started' is still running. A process which was created after the job
+    started has only reused the pid
+    '''
+    if psutil is None:
+        # Without psutil the job is assumed to have been left by a crash
+        return False
+    try:
+        return psutil.Process(pid).create_time() <= started + 1
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
+        return False
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def resume_jobs(path, keys):
+    '''
+    Function which returns the idfs of the previous run which do not have to
+    be simulated again: those done and those still running. 'keys' holds the
+    results key of each idf. Done idfs are only returned if the previous run
+    was interrupted (a crash leaves queued jobs or running jobs whose process
+    has gone) and were simulated with the same key. Idfs still being
+    simulated by another process are returned so that they are not
+    simulated twice
+    '''
+    with ledger(path) as connection:
+        rows = connection.execute('SELECT idf, key, status, pid, started '
+                                  'FROM jobs').fetchall()
+
+    running, interrupted = set(), False
+    for idf, key, status, pid, started in rows:
+        if status == 'queued':
+            interrupted = True
+        elif status == 'running':
+            if process_alive(pid, started):
+                running.add(idf)
+            else:
+                interrupted = True
+    if running:
+        print('{} idfs are being simulated by another process'.format(len(running)),
+              flush=True)
+    if not interrupted:
+        return set(), running
+
+    done = {idf for idf, key, status, _, _ in rows
+            if status == 'done' and keys.get(idf) == key}
+    print('Resuming an interrupted simulation run: {} of {} idfs are done'.format(
+          len(done & set(keys)), len(keys)), flush=True)
+    return done, running
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def queue_jobs(path, keys, skipped):
+    '''
+    Function which queues the jobs of a run. The jobs of the idfs which are
+    not part of the run are removed, those of the 'skipped' idfs are kept
+    '''
+    now = time.time()
+    with ledger(path) as connection:
+        connection.execute('CREATE TEMPORARY TABLE run (idf TEXT PRIMARY KEY)')
+        connection.executemany('INSERT INTO run VALUES (?)', [(idf,) for idf in keys])
+        connection.execute('DELETE FROM jobs WHERE idf NOT IN (SELECT idf FROM run)')
+        connection.executemany(
+            'INSERT OR REPLACE INTO jobs (idf, key, status, queued) '
+            'VALUES (?, ?, \'queued\', ?)',
+            [(idf, key, now) for idf, key in keys.items() if idf not in skipped])
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def start_job(path, idf, pid, started):
+    '''
+    Function which records that the process 'pid' has started a job
+    '''
+    with ledger(path) as connection:
+        connection.execute('UPDATE jobs SET status = \'running\', pid = ?, '
+                           'started = ? WHERE idf = ?', (pid, started, idf))
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def finish_job(path, idf, exit_code, seconds=None, counts=None):
+    '''
+    Function which records the end of a job, as done if E+ exited with 0 and
+    as failed otherwise. A simulated job is added to the history with the
+    simulation time 'seconds' and the idf object 'counts' (a dict keyed by
+    COUNT_COLUMNS). Jobs restored from the cache have no 'seconds' and are
+    not added
+    '''
+    now = time.time()
+    status = 'done' if exit_code == 0 else 'failed'
+    with ledger(path) as connection:
+        connection.execute('UPDATE jobs SET status = ?, finished = ?, exit_code = ? '
+                           'WHERE idf = ?', (status, now, exit_code, idf))
+        if seconds is not None:
+            connection.execute(
+                'INSERT INTO history SELECT idf, key, started, finished, '
+                'exit_code, ?, {} FROM jobs WHERE idf = ?'.format(
+                    ', '.join('?' * len(COUNT_COLUMNS))),
+                [seconds] + [counts[column] for column in COUNT_COLUMNS] + [idf])
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def runtime_history(path, limit):
+    '''
+    Function which returns the idf object counts (in the order of
+    COUNT_COLUMNS) and simulation time of the latest 'limit' successful
+    simulations
+    '''
+    with ledger(path) as connection:
+        return connection.execute(
+            'SELECT {}, seconds FROM history WHERE exit_code = 0 '
+            'ORDER BY rowid DESC LIMIT ?'.format(', '.join(COUNT_COLUMNS)),
+            (limit,)).fetchall()
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
@@ -16,21 +16,37 @@
 """
 
 import os
+import io
+import json
+import pickle
+import hashlib
+import contextlib
+import numpy as np
 import pandas as pd
+import shapely
 from ast import literal_eval
 from shapely.ops import unary_union, linemerge
 from shapely.wkt import loads, dumps
 from time import time, localtime, strftime
-from shapely.geometry import Polygon, LineString, MultiLineString, LinearRing, MultiPolygon
+from shapely.geometry import Polygon, LineString, MultiLineString, LinearRing, MultiPolygon, box
+from shapely.strtree import STRtree
+from shapely import __version__ as shapely_version
 import logging
+from simstocktables import write_table
+from simstockprocess import spawn_pool
 
 
 ROOT_DIR = os.path.abspath(os.path.dirname(__file__))
 
 tolerance = 0.1  # minimum allowed distance between 2 coordinates [m]
+halo = 1.0  # polygons closer than this are preprocessed in the same tile [m]
 
+# Shapely 2.x STRtree queries return indices and predicates accept arrays of
+# geometries
+SHAPELY_2 = int(shapely_version.split('.')[0]) >= 2
 
-def main():
+
+def main(python=None, cwd=None):
     start = time()
     print('__________________________________________________________________',
           flush=True)
@@ -41,6 +57,16 @@ def main():
     # Load the raw data into pandas dataframe
     df = pd.read_csv(os.path.join(ROOT_DIR, 'sa_data.csv'), dtype={'construction':str})
 
+    # Load config file
+    with open(os.path.join(ROOT_DIR, "config.json"), "r") as read_file:
+        config = json.load(read_file)
+    cores = int(config.get("Preprocessing cores", 1))
+    csv_export = config.get("Preprocessed csv export", "false").lower() == "true"
+
+    # Parse the polygons once. The 'sa_polygon' column holds shapely objects
+    # for the whole preprocessing and is only converted to text when saved
+    df['sa_polygon'] = df['polygon'].apply(loads)
+
     # Check for nested polygons
     df = check_for_multipolygon(df)
 
@@ -65,25 +91,22 @@ def main():
     # between two consecutive coordinates
     df = polygon_tolerance(df)
     simplify_polygon_no = df['sa_polygon_simplify'].sum()
-    if simplify_polygon_no > 0:
-        df = polygon_simplification(df, simplify_polygon_no)
-
-    # Check polygon topology after simplification (no intersection allowed)
-    df = polygon_topology(df, 'sa_simplified_touching',
-                          'sa_simplified_intersect')
-
-    # Remove collinear points and determine exterior surfaces coordinates
-    df = collinear_exterior(df)
 
-    # Check polygon topology after collinearity check (no intersection allowed)
-    df = polygon_topology(df, 'sa_collinear_touching',
-                          'sa_collinear_intersect')
+    # Simplification, collinearity and the topology checks after them only
+    # involve touching polygons, so they can run on separate tiles in parallel
+    # and unchanged clusters of polygons can be reused from the previous run
+    if cwd is not None:
+        df = cached_preprocessing(df, simplify_polygon_no, cores, python, cwd)
+    elif cores > 1:
+        df = tiled_preprocessing(df, simplify_polygon_no, cores, python)
+    else:
+        df = local_preprocessing(df, simplify_polygon_no)
 
     # Adds a column denoting built islands if applicable
     newdf = bi_adj(df)
     
     # save preprocessed file
-    newdf.to_csv(os.path.join(ROOT_DIR, 'sa_preprocessed.csv'), index=False)
+    save_preprocessed(newdf, ROOT_DIR, csv=csv_export)
 
     # Raise error if BIs were not properly resolved
     if len(newdf["bi"]) != len(newdf["bi"].dropna()):
@@ -97,16 +120,292 @@ def main():
 
 # END OF MAIN  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
+
+def local_preprocessing(df, simplify_polygon_no):
+    '''
+    Function which runs the preprocessing steps that only depend on touching
+    polygons: simplification, collinearity and the topology checks after them
+    '''
+    if simplify_polygon_no > 0:
+        df = polygon_simplification(df, simplify_polygon_no)
+
+    # Check polygon topology after simplification (no intersection allowed)
+    df = polygon_topology(df, 'sa_simplified_touching',
+                          'sa_simplified_intersect')
+
+    # Remove collinear points and determine exterior surfaces coordinates
+    df = collinear_exterior(df)
+
+    # Check polygon topology after collinearity check (no intersection allowed)
+    df = polygon_topology(df, 'sa_collinear_touching',
+                          'sa_collinear_intersect')
+    return df
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def tiled_preprocessing(df, simplify_polygon_no, cores, python=None):
+    '''
+    Function which runs local_preprocessing on spatial tiles in a pool of
+    processes and stitches the tiles back into the original row order.
+    Polygons within the halo distance of each other are always put in the
+    same tile, so every tile sees all the neighbours its polygons can touch
+    and the result is the same as the serial run. 'python' is the
+    interpreter used for the worker processes (the QGIS python when run from
+    the plugin)
+    '''
+    tiles = preprocessing_tiles(df, cores)
+    if len(tiles) < 2:
+        return local_preprocessing(df, simplify_polygon_no)
+    print('Preprocessing {} polygons in {} tiles on {} cores'.format(
+        len(df), len(tiles), cores), flush=True)
+
+    jobs = [(df.iloc[tile], simplify_polygon_no) for tile in tiles]
+    with spawn_pool(min(cores, len(jobs)), python) as pool:
+        results = pool.map(preprocess_tile, jobs, chunksize=1)
+
+    # Print the tile messages (e.g. intersection warnings) in tile order
+    for _, printout in results:
+        if printout:
+            print(printout, end='', flush=True)
+
+    # Stitch the tiles (removed polygons are missing) in the original order
+    position = {osgb: i for i, osgb in enumerate(df['osgb'])}
+    df = pd.concat([tile_df for tile_df, _ in results])
+    df = df.sort_values('osgb', key=lambda osgb: osgb.map(position))
+    return df.reset_index(drop=True)
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def preprocess_tile(job):
+    '''
+    Function which runs local_preprocessing for a single tile in a worker
+    process. Returns the tile dataframe and whatever was printed
+    '''
+    tile_df, simplify_polygon_no = job
+    tile_df = tile_df.reset_index(drop=True)
+    with contextlib.redirect_stdout(io.StringIO()) as printout:
+        tile_df = local_preprocessing(tile_df, simplify_polygon_no)
+    return tile_df, printout.getvalue()
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def halo_clusters(df):
+    '''
+    Function which groups polygons whose bounding boxes come within the halo
+    distance of each other. Polygons in different clusters never touch, so
+    each cluster can be preprocessed on its own. Returns lists of row
+    positions as connected_components does
+    '''
+    halos = [box(minx - halo / 2, miny - halo / 2, maxx + halo / 2, maxy + halo / 2)
+             for minx, miny, maxx, maxy in (p.bounds for p in df['sa_polygon'])]
+    adjacency = [list() for _ in halos]
+    for i, j in bbox_candidate_pairs(halos):
+        adjacency[i].append(j)
+        adjacency[j].append(i)
+    return connected_components(adjacency)
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def preprocessing_tiles(df, cores):
+    '''
+    Function which splits the polygons into spatial tiles. A halo cluster is
+    never split: it goes to the tile holding its first polygon. The grid aims
+    at about four tiles per core, and the tiles are returned largest first as
+    lists of row positions in the original order
+    '''
+    bounds = [polygon.bounds for polygon in df['sa_polygon']]
+    clusters = halo_clusters(df)
+
+    minx = min(b[0] for b in bounds)
+    miny = min(b[1] for b in bounds)
+    size = max(max(b[2] for b in bounds) - minx,
+               max(b[3] for b in bounds) - miny)
+    cells_per_side = max(1, round((4 * cores) ** 0.5))
+    cell_size = size / cells_per_side or 1.0
+    tiles = dict()
+    for cluster in clusters:
+        x, y = bounds[cluster[0]][:2]
+        cell = (int((x - minx) // cell_size), int((y - miny) // cell_size))
+        tiles.setdefault(cell, list()).extend(cluster)
+    tiles = [sorted(tile) for tile in tiles.values()]
+    return sorted(tiles, key=len, reverse=True)
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def cached_preprocessing(df, simplify_polygon_no, cores, python, cwd):
+    '''
+    Function which only runs the local preprocessing for halo clusters which
+    changed since the previous run in the user cwd. Each cluster is keyed by a
+    hash of its input rows, and the outputs and intersection warnings of the
+    clusters are kept in a cache file which is rewritten after every run
+    '''
+    cache_file = os.path.join(cwd, 'sa_preprocessing_cache.pkl')
+    cache = load_preprocessing_cache(cache_file)
+    cached_df, cached_clusters = cache['df'], cache['clusters']
+
+    clusters = halo_clusters(df)
+    rows = row_fingerprints(df)
+    keys = [cluster_key([rows[i] for i in cluster], df.columns,
+                        simplify_polygon_no)
+            for cluster in clusters]
+    dirty = sorted(i for cluster, key in zip(clusters, keys)
+                   if key not in cached_clusters for i in cluster)
+    print('Reusing {} of {} polygons from the preprocessing cache'.format(
+        len(df) - len(dirty), len(df)), flush=True)
+
+    # Preprocess the changed clusters and keep what they print
+    new_df = df.iloc[dirty].reset_index(drop=True)
+    printout = ''
+    if dirty:
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            if cores > 1:
+                new_df = tiled_preprocessing(new_df, simplify_polygon_no,
+                                             cores, python)
+            else:
+                new_df = local_preprocessing(new_df, simplify_polygon_no)
+        printout = output.getvalue()
+
+    # Intersection warnings start with the osgb they belong to
+    warnings = dict()
+    prefix = '***WARNING: OSGB '
+    for line in printout.splitlines(keepends=True):
+        if line.startswith(prefix):
+            osgb = line[len(prefix):].split(' intersects following')[0]
+            warnings.setdefault(osgb, list()).append(line)
+        else:
+            print(line, end='', flush=True)
+
+    # Collect the rows and warnings of every cluster, new or cached
+    new_position = {osgb: i for i, osgb in enumerate(new_df['osgb'])}
+    cached_position = {osgb: i for i, osgb in enumerate(cached_df['osgb'])}
+    parts, clusters_cache = list(), dict()
+    for cluster, key in zip(clusters, keys):
+        if key in cached_clusters:
+            osgb_list, lines = cached_clusters[key]
+            parts.append(cached_df.iloc[[cached_position[o] for o in osgb_list]])
+        else:
+            osgb_list = [o for o in df['osgb'].iloc[cluster]
+                         if o in new_position]
+            lines = [line for o in osgb_list for line in warnings.get(str(o), [])]
+            parts.append(new_df.iloc[[new_position[o] for o in osgb_list]])
+        clusters_cache[key] = (osgb_list, lines)
+        if not osgb_list:
+            parts.pop()
+        for line in lines:
+            print(line, end='', flush=True)
+
+    # Stitch the clusters (removed polygons are missing) in the original order
+    position = {osgb: i for i, osgb in enumerate(df['osgb'])}
+    df = pd.concat(parts) if parts else new_df
+    df = df.sort_values('osgb', key=lambda osgb: osgb.map(position))
+    df = df.reset_index(drop=True)
+
+    save_preprocessing_cache(cache_file, {'df': df, 'clusters': clusters_cache})
+    return df
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def row_fingerprints(df):
+    '''
+    Function which serialises every input row (the polygon as WKB and the
+    other columns as text) for hashing into the cluster keys
+    '''
+    attributes = df.drop(['sa_polygon'], axis=1)
+    return [polygon.wkb + repr(tuple(row)).encode()
+            for polygon, row in zip(df['sa_polygon'],
+                                    attributes.itertuples(index=False))]
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def cluster_key(rows, columns, simplify_polygon_no):
+    '''
+    Function which hashes the input rows of a halo cluster (geometry and all
+    attributes) together with whether any polygon in the layer needs
+    simplification, which decides if the simplification passes run at all
+    '''
+    key = hashlib.sha256()
+    key.update(repr((list(columns), bool(simplify_polygon_no > 0),
+                     tolerance)).encode())
+    for row in rows:
+        key.update(len(row).to_bytes(8, 'little'))
+        key.update(row)
+    return key.hexdigest()
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def load_preprocessing_cache(cache_file):
+    '''
+    Function which loads the preprocessing cache. The cache is discarded if
+    it is missing, unreadable or was written by a different version of this
+    file
+    '''
+    empty_cache = {'df': pd.DataFrame({'osgb': []}), 'clusters': dict()}
+    try:
+        with open(cache_file, 'rb') as read_file:
+            cache = pickle.load(read_file)
+    except Exception:
+        return empty_cache
+    if cache.get('version') != source_version():
+        return empty_cache
+    return cache
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def save_preprocessing_cache(cache_file, cache):
+    '''
+    Function which writes the preprocessing cache to a temporary file and
+    then replaces the old cache, so an interrupted run never leaves a
+    partially written cache behind
+    '''
+    cache['version'] = source_version()
+    temporary_file = cache_file + '.tmp'
+    try:
+        with open(temporary_file, 'wb') as write_file:
+            pickle.dump(cache, write_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_file, cache_file)
+    except OSError as err:
+        print('Preprocessing cache could not be saved: {}'.format(err),
+              flush=True)
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def source_version():
+    '''
+    Function which hashes this file and the versions of shapely, pandas and
+    numpy, so that cached results are not reused after the preprocessing
+    code changes or a library upgrade changes its results (e.g. simplify,
+    buffer or touches in shapely)
+    '''
+    version = hashlib.sha256()
+    with open(os.path.abspath(__file__), 'rb') as read_file:
+        version.update(read_file.read())
+    version.update(repr((shapely.__version__, pd.__version__,
+                         np.__version__)).encode())
+    return version.hexdigest()
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
 def check_for_multipolygon(df):
     """
     Hand-drawn polygons can be multipolygons with len 1, i.e. a nested 
     polygon within a multipolygon wrapper. This aims to extract them.
     """
     for row in df.itertuples():
-        polygon = loads(row.polygon)
+        polygon = row.sa_polygon
         if isinstance(polygon, MultiPolygon):
             if len(polygon.geoms) == 1:
                 df.at[row.Index, "polygon"] = str(polygon.geoms[0])
+                df.at[row.Index, "sa_polygon"] = polygon.geoms[0]
             else:
                 raise RuntimeError("Polygon for '%s' is a multipolygon." % row.osgb)
     return df
@@ -118,60 +417,111 @@ def check_for_duplicates(df):
     
     If these are not removed, the associated issues will only arise during the 
     EnergyPlus simulation, when it will complain of duplicate surfaces.
+
+    Polygons are bucketed by a normalised fingerprint so that only polygons
+    sharing a fingerprint are compared with the exact equals check.
     """
-    polygons = df["polygon"].apply(loads)
-    unique_polys = []
-    
-    for poly in polygons:
-        if not any(p.equals(poly) for p in unique_polys):
-            unique_polys.append(poly)
-    no_duplicates = len(polygons) - len(unique_polys)
+    buckets = dict()
+    duplicates = dict()
+    for osgb, poly in zip(df["osgb"], df["sa_polygon"]):
+        bucket = buckets.setdefault(polygon_fingerprint(poly), list())
+        for first_osgb, p in bucket:
+            if p.equals(poly):
+                duplicates.setdefault(first_osgb, list()).append(osgb)
+                break
+        else:
+            bucket.append((osgb, poly))
+    no_duplicates = sum(len(d) for d in duplicates.values())
 
     if no_duplicates > 0:
-        raise Exception(f"{no_duplicates} duplicate polygons detected!")
+        groups = ["%s (duplicated by %s)" % (osgb, ", ".join(map(str, d)))
+                  for osgb, d in duplicates.items()]
+        raise Exception(f"{no_duplicates} duplicate polygons detected! "
+                        f"The duplicated polygons are: {'; '.join(groups)}")
+
+def polygon_fingerprint(polygon):
+    """
+    Returns a hashable fingerprint which is the same for polygons covering the
+    same area regardless of ring orientation, starting vertex, repeated
+    vertices or vertices in the middle of straight edges. Coordinates are
+    snapped to 1e-6 so equal polygons always share a fingerprint; different
+    polygons may share one too, which is why the equals check is still made.
+    """
+    def ring_key(coords):
+        coords = [(round(x, 6), round(y, 6)) for x, y in coords[:-1]]
+        # Drop repeated and collinear vertices
+        changed = True
+        while changed and len(coords) > 3:
+            changed = False
+            for i in range(len(coords)):
+                a, b, c = coords[i - 1], coords[i], coords[(i + 1) % len(coords)]
+                cross = (b[0] - a[0]) * (c[1] - b[1]) - (b[1] - a[1]) * (c[0] - b[0])
+                if b == a or cross == 0:
+                    del coords[i]
+                    changed = True
+                    break
+        # Fixed (clockwise) orientation and the smallest vertex first
+        area = sum(coords[i - 1][0] * coords[i][1] - coords[i][0] * coords[i - 1][1]
+                   for i in range(len(coords)))
+        if area > 0:
+            coords = coords[::-1]
+        start = coords.index(min(coords))
+        return tuple(coords[start:] + coords[:start])
+
+    if polygon.geom_type != "Polygon" or polygon.is_empty:
+        return polygon.wkb
+    holes = sorted(ring_key(list(r.coords)) for r in polygon.interiors)
+    return (ring_key(list(polygon.exterior.coords)), tuple(holes))
 
 def bi_adj(df):
     # TODO: Buildings connected by only shading blocks are still considered
     #       to be a single BI. This is probably unnecessary since there will be
     #       no energy transfer between thermally simulated dwellings.
-    df['sa_polygon'] = df['sa_polygon'].apply(loads)
     gdf = df.copy(deep=True) #recoded to avoid using geopandas
-    polygon_union = unary_union(gdf.sa_polygon)
-
-    if polygon_union.geom_type == "MultiPolygon":
-        for bi in polygon_union.geoms:
+    polygons = gdf['sa_polygon'].tolist()
+
+    # Built islands are the connected components of the party wall graph
+    position = {osgb: i for i, osgb in enumerate(gdf['osgb'])}
+    adjacency = [[position[t] for t in literal_eval(touching)]
+                 for touching in gdf['sa_collinear_touching']]
+    components = connected_components(adjacency)
+    islands = [unary_union([polygons[i] for i in c]) for c in components]
+    overlapping, meeting = island_relations(islands)
+
+    # Polygons which overlap without sharing a wall are not in the graph
+    # (they are reported by polygon_topology) but still form one island
+    if any(overlapping):
+        components = [sorted(i for c in group for i in components[c])
+                      for group in connected_components(overlapping)]
+        islands = [unary_union([polygons[i] for i in c]) for c in components]
+        overlapping, meeting = island_relations(islands)
+
+    bi_column = [None] * len(polygons)
+    for component, island, meeting_islands in zip(components, islands,
+                                                  meeting):
+        if meeting_islands:
+            # Islands meeting at a point add that point to the outline as a
+            # vertex when the whole layer is merged, which moves the
+            # representative point. Include them so the names do not change
+            meeting_polygons = [polygons[i] for m in meeting_islands
+                                for i in components[m]]
+            noded = unary_union([island] + meeting_polygons)
+            parts = [part for part in getattr(noded, 'geoms', [noded])
+                     if island.relate(part)[0] != 'F']
+        else:
+            parts = list(getattr(island, 'geoms', [island]))
+        for bi in parts:
             # Get a unique name for the BI which is based on a point
             # within the BI so that it doesn't change if new areas are lassoed
             rep_point = bi.representative_point()
             bi_name = "bi_" + str(round(rep_point.x, 2)) + "_" + str(round(rep_point.y, 2))
             bi_name = bi_name.replace(".", "-") #replace dots with dashes for filename compatibility
-            for row in gdf.itertuples():
-                if row.sa_polygon.within(bi):
-                    gdf.at[row.Index, 'bi'] = bi_name
-    else:
-        # If there is only one BI
-        rep_point = polygon_union.representative_point()
-        bi_name = "bi_" + str(round(rep_point.x, 2)) + "_" + str(round(rep_point.y, 2))
-        bi_name = bi_name.replace(".", "-")
-        for row in gdf.itertuples():
-            gdf.at[row.Index, 'bi'] = bi_name
-
-        ### The following part just checks consistency against internal simstock
-        ### adjacent polygon calculations. Not necessary but nice to have. Needs
-        ### to be recoded without geopandas
-        
-        # for index, row in gdf.iterrows():
-        #     touching = gdf[gdf.polygon.touches(row['polygon'])]
-        #     adj_checked = []
-        #     for i, building in touching.iterrows():
-        #             if row['polygon'].intersection(building['polygon']).type in ["LineString", "MultiLineString"]:
-        #                 adj_checked.append(building['osgb'])
-        #     gdf.at[index, "adjacent"] = str(adj_checked)
-            
-        # for i, row in gdf.iterrows():
-        #     if row['sa_collinear_touching'] != row['adjacent']:
-        #         raise RuntimeError("built island mismatch")
-        # Can drop the adjacent column at this point
+            # Polygons only meeting at points give separate islands, so fall
+            # back to checking which part each polygon is within
+            for i in component:
+                if len(parts) == 1 or polygons[i].within(bi):
+                    bi_column[i] = bi_name
+    gdf['bi'] = bi_column
 
     try:
         non_shading_gdf = gdf[gdf["shading"] == False]["bi"]
@@ -184,6 +534,57 @@ def bi_adj(df):
 
     return gdf
 
+def connected_components(adjacency):
+    '''
+    Function which labels the connected components of a graph given as a list
+    of adjacent positions for each position (union-find with path halving).
+    Returns a list of components, each a sorted list of positions, ordered by
+    their first position
+    '''
+    parent = list(range(len(adjacency)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, adjacent in enumerate(adjacency):
+        for j in adjacent:
+            root_i, root_j = find(i), find(j)
+            if root_i != root_j:
+                parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    components = dict()
+    for i in range(len(adjacency)):
+        components.setdefault(find(i), list()).append(i)
+    return list(components.values())
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def island_relations(islands):
+    '''
+    Function which finds, for each built island geometry, the positions of
+    the islands overlapping it (interiors intersect) and of the islands
+    meeting it only along the boundary
+    '''
+    overlapping = [list() for _ in islands]
+    meeting = [list() for _ in islands]
+    for i, j in bbox_candidate_pairs(islands):
+        # Matrix order: II, IB, IE, BI, BB, BE, EI, EB, EE
+        matrix = islands[i].relate(islands[j])
+        if matrix[0] != 'F':
+            overlapping[i].append(j)
+            overlapping[j].append(i)
+        elif matrix[4] != 'F':
+            meeting[i].append(j)
+            meeting[j].append(i)
+    return overlapping, meeting
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
 def pt(printout, pst):
     pft = time()
     process_time = pft - pst
@@ -203,10 +604,59 @@ def pt(printout, pst):
 # END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
+def round_coordinates(geometry):
+    '''
+    Function which rounds polygon coordinates to 2 decimal spaces. The result
+    is the same as the WKT round trip loads(dumps(geometry, 2)) without
+    writing and parsing the text
+    '''
+    if geometry.geom_type != 'Polygon':
+        return loads(dumps(geometry, rounding_precision=2))
+
+    def round_ring(coords):
+        return [tuple(round(coord, 2) for coord in ordered_pair)
+                for ordered_pair in coords]
+
+    if geometry.is_empty:
+        return geometry
+    inner_rings = [round_ring(item.coords) for item in geometry.interiors]
+    return Polygon(round_ring(geometry.exterior.coords), inner_rings)
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def save_preprocessed(df, directory, csv=False):
+    '''
+    Function which saves the preprocessed data as a typed table for
+    simstocktwo, mptest and the plugin. Exposed walls and horizontal polygons
+    are rounded to 2 decimals as in the text output. The csv (geometries as
+    WKT text) is only written if requested, e.g. for debugging
+    '''
+    if csv:
+        csv_df = df.copy()
+        csv_df['sa_polygon'] = [polygon.wkt for polygon in csv_df['sa_polygon']]
+        for column in ['sa_polygon_exposed_wall', 'sa_polygon_horizontal']:
+            csv_df[column] = [dumps(geometry, rounding_precision=2)
+                              for geometry in csv_df[column]]
+        csv_df.to_csv(os.path.join(directory, 'sa_preprocessed.csv'),
+                      index=False)
+
+    df = df.copy()
+    df['polygon'] = [loads(polygon) for polygon in df['polygon']]
+    for column in ['sa_polygon_exposed_wall', 'sa_polygon_horizontal']:
+        df[column] = [round_coordinates(geometry) for geometry in df[column]]
+    for column in ['sa_initial_touching', 'sa_simplified_touching',
+                   'sa_collinear_touching']:
+        df[column] = [literal_eval(osgb_list) for osgb_list in df[column]]
+    write_table(df, directory, 'sa_preprocessed')
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
 def polygon_testing(df):
     for row in df.itertuples():
         osgb = row.osgb
-        polygon = loads(row.polygon)
+        polygon = row.sa_polygon
 
         if not polygon.is_valid:
             print('{} polygon is not valid'.format(osgb))
@@ -228,7 +678,7 @@ def polygon_testing(df):
 def reverse_coordinates(df):
     for row in df.itertuples():
         if row.sa_reverse_coordinates:
-            polygon = loads(row.polygon)
+            polygon = row.sa_polygon
             if polygon.exterior.is_ccw:
                 ext_ring_coords = list(polygon.exterior.coords[::-1])
             else:
@@ -242,8 +692,10 @@ def reverse_coordinates(df):
                         item_coords = list(item.coords)
                     int_ring.append(item_coords)
             polygon_reversed = Polygon(ext_ring_coords, int_ring)
-            df.loc[row.Index, 'polygon'] = dumps(
+            df.at[row.Index, 'polygon'] = dumps(
                 polygon_reversed, rounding_precision=2)
+            df.at[row.Index, 'sa_polygon'] = round_coordinates(
+                polygon_reversed)
     return df
 
 # END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
@@ -251,7 +703,7 @@ def reverse_coordinates(df):
 
 def remove_duplicated_coordinates(df):
     for row in df.itertuples():
-        polygon = loads(row.polygon)
+        polygon = row.sa_polygon
         ext_ring_coords = list(polygon.exterior.coords)
         ext_ring_no_dup = remove_duplicated_coords_from_list(ext_ring_coords)
         int_ring_no_dup_list = list()
@@ -262,8 +714,7 @@ def remove_duplicated_coordinates(df):
                     item_coords)
                 int_ring_no_dup_list.append(int_ring_no_dup)
         polygon_no_dup = Polygon(ext_ring_no_dup, int_ring_no_dup_list)
-        df.loc[row.Index, 'sa_polygon'] = dumps(
-            polygon_no_dup, rounding_precision=2)
+        df.at[row.Index, 'sa_polygon'] = round_coordinates(polygon_no_dup)
     return df
 
 # END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
@@ -291,38 +742,116 @@ def remove_duplicated_coords_from_list(coords_list):
 
 
 def polygon_topology(df, touching, intersect):
-    df[touching] = '[]'
-    df[intersect] = '[]'
     osgb_polygon_pairs = variable_polygon_pairs(df, 'osgb', 'sa_polygon')
-    for osgb, osgb_polygon in osgb_polygon_pairs:
-        osgb_touching, osgb_intersect = list(), list()
-        for osgb_adj, adj_polygon in osgb_polygon_pairs:
-            if osgb_adj != osgb:
-                if osgb_polygon.touches(adj_polygon) and (
-                        osgb_polygon.intersection(
-                            adj_polygon).geom_type not in ['Point']):
-                    osgb_touching.append(osgb_adj)
-                if osgb_polygon.intersects(adj_polygon) and (
-                        osgb_polygon.intersection(
-                            adj_polygon).geom_type not in ['Point']):
-                    osgb_intersect.append(osgb_adj)
-        df.loc[df['osgb'] == osgb, touching] = str(osgb_touching)
-        df.loc[df['osgb'] == osgb, intersect] = str(osgb_intersect)
+    osgb_list = [osgb for osgb, _ in osgb_polygon_pairs]
+    polygons = [polygon for _, polygon in osgb_polygon_pairs]
+    touching_lists, intersect_lists = polygon_adjacency(polygons)
+    touching_column, intersect_column = list(), list()
+    for i, osgb in enumerate(osgb_list):
+        osgb_touching = [osgb_list[j] for j in touching_lists[i]]
+        osgb_intersect = [osgb_list[j] for j in intersect_lists[i]]
+        touching_column.append(str(osgb_touching))
+        intersect_column.append(str(osgb_intersect))
         if len(osgb_touching) < len(osgb_intersect):
             difference = list(set(osgb_intersect) - set(osgb_touching))
             print('***WARNING: OSGB {} intersects following polygon(s): {}'.format(osgb,
                                                                                    difference), flush=True)
+    df[touching] = touching_column
+    df[intersect] = intersect_column
     df = df.drop([intersect], axis=1)
     return df
 
 # END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
+def polygon_adjacency(polygons):
+    '''
+    Function which finds touching and intersecting polygons. Only pairs of
+    polygons with intersecting bounding boxes are tested and each pair is
+    tested once. Returns two lists (touching and intersecting) holding, for
+    each polygon, the sorted positions of the related polygons
+    '''
+    touching_lists = [list() for _ in polygons]
+    intersect_lists = [list() for _ in polygons]
+    for i, j in bbox_candidate_pairs(polygons):
+        touches, intersects = polygon_relation(polygons[i], polygons[j])
+        if touches:
+            touching_lists[i].append(j)
+            touching_lists[j].append(i)
+        if intersects:
+            intersect_lists[i].append(j)
+            intersect_lists[j].append(i)
+    for item in touching_lists + intersect_lists:
+        item.sort()
+    return touching_lists, intersect_lists
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def bbox_candidate_pairs(polygons):
+    '''
+    Function which queries an STRtree spatial index for the pairs of polygons
+    with intersecting bounding boxes. Returns a list of (i, j) position pairs
+    with i < j
+    '''
+    if not polygons:
+        return list()
+    tree = STRtree(polygons)
+    if SHAPELY_2:
+        query_positions, tree_positions = tree.query(polygons)
+        return [(i, j) for i, j in zip(query_positions.tolist(),
+                                       tree_positions.tolist()) if i < j]
+    # Shapely 1.x returns the geometries themselves
+    positions = {id(polygon): i for i, polygon in enumerate(polygons)}
+    pairs = list()
+    for i, polygon in enumerate(polygons):
+        for candidate in tree.query(polygon):
+            j = positions[id(candidate)]
+            if i < j:
+                pairs.append((i, j))
+    return pairs
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def polygon_relation(polygon, adj_polygon):
+    '''
+    Function which uses a single DE-9IM relate call to find whether two
+    polygons touch and whether they intersect. As before, relations where the
+    polygons only share a single point are ignored
+    '''
+    # Matrix order: II, IB, IE, BI, BB, BE, EI, EB, EE
+    matrix = polygon.relate(adj_polygon)
+    interiors = matrix[0]
+    boundaries = [matrix[1], matrix[3], matrix[4]]
+    if interiors == 'F' and boundaries == ['F', 'F', 'F']:
+        return False, False
+    touches = interiors == 'F'
+    # Interiors or boundaries sharing an area or a line can not be a point.
+    # Otherwise polygons meet at point(s) and only a single point is ignored
+    if interiors == 'F' and '1' not in boundaries:
+        if polygon.intersection(adj_polygon).geom_type in ['Point']:
+            return False, False
+    return touches, True
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def osgb_index(df):
+    '''
+    Function which maps each osgb to its row label so that rows can be read
+    and written with df.at in constant time instead of scanning the osgb
+    column. Must be rebuilt whenever the dataframe index changes
+    '''
+    return dict(zip(df['osgb'], df.index))
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
 def variable_polygon_pairs(df, variable_value, polygon_value):
     variable_polygon_values = df[[variable_value, polygon_value]].values
     variable_polygon = list()
     for variable, polygon in variable_polygon_values:
-        polygon = loads(polygon)
         variable_polygon.append([variable, polygon])
     return variable_polygon
 
@@ -340,20 +869,18 @@ def polygon_tolerance(df):
                 return True
         return False
 
-    for row in df.itertuples():
-        polygon = loads(row.sa_polygon)
+    simplify_list = list()
+    for polygon in df['sa_polygon']:
         ext_ring_coords = list(polygon.exterior.coords)
         simplify_required = distance_within_tolerance(ext_ring_coords)
-        df.loc[row.Index, 'sa_polygon_simplify'] = simplify_required
-        if simplify_required:
-            continue
-        if polygon.interiors:
+        if not simplify_required and polygon.interiors:
             for item in polygon.interiors:
                 item_coords = list(item.coords)
                 simplify_required = distance_within_tolerance(item_coords)
                 if simplify_required:
-                    df.loc[row.Index, 'sa_polygon_simplify'] = simplify_required
                     break
+        simplify_list.append(simplify_required)
+    df['sa_polygon_simplify'] = simplify_list
     return df
 
 # END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
@@ -362,13 +889,12 @@ def polygon_tolerance(df):
 def polygon_simplification(df, simplify_polygon_no):
 
     def polygon_within_hole(df):
+        osgb_polygon_pairs = variable_polygon_pairs(df, 'osgb', 'sa_polygon')
         for row in df.itertuples():
-            osgb_polygon = loads(row.sa_polygon)
+            osgb_polygon = row.sa_polygon
             osgb_within_hole = list()
             if osgb_polygon.interiors:
                 osgb = row.osgb
-                osgb_polygon_pairs = variable_polygon_pairs(
-                    df, 'osgb', 'sa_polygon')
                 for item in osgb_polygon.interiors:
                     item_polygon = Polygon(item.coords[::-1])
                     for osgb_adj, adj_polygon in osgb_polygon_pairs:
@@ -382,11 +908,18 @@ def polygon_simplification(df, simplify_polygon_no):
     def polygon_simplify(df):
 
         def touching_poly(df, osgb, polygon, osgb_list, osgb_touching):
+            if SHAPELY_2:
+                # Test against the current polygons in one vectorised call
+                # (removed polygons are None and never touch)
+                touches = shapely.touches(polygon, df['sa_polygon'].to_numpy())
+                for t, t_touches in zip(osgb_list, touches):
+                    if t_touches and t != osgb:
+                        osgb_touching.append(t)
+                return osgb_touching
             for t in osgb_list:
                 if t != osgb:
-                    if df.loc[df['osgb'] == t, 'sa_polygon'].values[0]:
-                        t_polygon = loads(
-                            df.loc[df['osgb'] == t, 'sa_polygon'].values[0])
+                    t_polygon = df.at[osgb_row[t], 'sa_polygon']
+                    if t_polygon is not None:
                         if polygon.touches(t_polygon):
                             osgb_touching.append(t)
             return osgb_touching
@@ -483,16 +1016,12 @@ def polygon_simplification(df, simplify_polygon_no):
                 def remove_hole_if_inner_is_removed(
                         df, inner_polygon, polygon_within_hole):
                     for p in polygon_within_hole:
-                        p_polygon = df.loc[df['osgb'] ==
-                                           p, 'sa_polygon'].values[0]
-                        if p_polygon:
-                            p_polygon = loads(p_polygon)
+                        p_polygon = df.at[osgb_row[p], 'sa_polygon']
+                        if p_polygon is not None:
                             if inner_polygon.contains(p_polygon):
-                                df.loc[df['osgb'] == p,
-                                       'sa_polygon'] = False
+                                df.at[osgb_row[p], 'sa_polygon'] = None
                                 p_polygon_within_hole = literal_eval(
-                                    df.loc[df['osgb'] == p,
-                                           'sa_polygon_within_hole'].values[0])
+                                    df.at[osgb_row[p], 'sa_polygon_within_hole'])
                                 if p_polygon_within_hole:
                                     df = remove_holes(
                                         df, p_polygon_within_hole)
@@ -523,11 +1052,8 @@ def polygon_simplification(df, simplify_polygon_no):
                                 if len(new_inner_coords) > 3:
                                     if polygon_within_hole:
                                         for p in polygon_within_hole:
-                                            p_polygon = df.loc[df['osgb'] ==
-                                                               p, 'sa_polygon'].values[0]
-                                            if p_polygon:
-                                                p_polygon = loads(
-                                                    p_polygon)
+                                            p_polygon = df.at[osgb_row[p], 'sa_polygon']
+                                            if p_polygon is not None:
                                                 if inner_polygon.contains(p_polygon):
                                                     p_outer_coords = list(
                                                         p_polygon.exterior.coords)
@@ -551,18 +1077,17 @@ def polygon_simplification(df, simplify_polygon_no):
                                                             new_p_polygon = Polygon(
                                                                 p_outer_coords, p_polygon.interiors)
                                                             p_polygon_within_hole = literal_eval(
-                                                                df.loc[df['osgb'] == p, 'sa_polygon_within_hole'].values[0])
+                                                                df.at[osgb_row[p], 'sa_polygon_within_hole'])
                                                             mock_list = list()
                                                             df, new_p_polygon = not_valid_polygons(
                                                                 p, new_p_polygon, df, p_outer_coords, p_polygon_within_hole, mock_list)
                                                         else:
                                                             new_p_polygon = Polygon(
                                                                 p_outer_coords)
-                                                        df.loc[df['osgb'] == p, 'sa_polygon'] = dumps(
-                                                            new_p_polygon, rounding_precision=2)
+                                                        df.at[osgb_row[p], 'sa_polygon'] = round_coordinates(
+                                                            new_p_polygon)
                                                     else:
-                                                        df.loc[df['osgb'] == p,
-                                                               'sa_polygon'] = False
+                                                        df.at[osgb_row[p], 'sa_polygon'] = None
                                     else:
                                         mock_list = list()
                                         new_inner_coords, _ = simplified_coords(
@@ -584,17 +1109,16 @@ def polygon_simplification(df, simplify_polygon_no):
             def remove_holes(df, polygon_within_hole):
                 if polygon_within_hole:
                     for p in polygon_within_hole:
-                        p_polygon = df.loc[df['osgb'] ==
-                                           p, 'sa_polygon'].values[0]
+                        p_polygon = df.at[osgb_row[p], 'sa_polygon']
                         p_polygon_within_hole = literal_eval(
-                            df.loc[df['osgb'] == p, 'sa_polygon_within_hole'].values[0])
-                        if p_polygon and p_polygon_within_hole:
+                            df.at[osgb_row[p], 'sa_polygon_within_hole'])
+                        if p_polygon is not None and p_polygon_within_hole:
                             df = remove_holes(df, p_polygon_within_hole)
-                        df.loc[df['osgb'] == p, 'sa_polygon'] = False
+                        df.at[osgb_row[p], 'sa_polygon'] = None
                 return df
 
             polygon_within_hole = literal_eval(
-                df.loc[df['osgb'] == osgb, 'sa_polygon_within_hole'].values[0])
+                df.at[osgb_row[osgb], 'sa_polygon_within_hole'])
             rlp = list()
             outer_coords, rlp = simplified_coords(polygon, 'outer', rlp)
             if len(outer_coords) > 3:
@@ -609,24 +1133,19 @@ def polygon_simplification(df, simplify_polygon_no):
                         polygon_within_hole, rlp)
                 else:
                     new_polygon = Polygon(outer_coords)
-                df.loc[df['osgb'] == osgb,
-                       'sa_polygon'] = dumps(new_polygon, rounding_precision=2)
+                df.at[osgb_row[osgb], 'sa_polygon'] = round_coordinates(new_polygon)
             else:
-                df.loc[df['osgb'] == osgb, 'sa_polygon'] = False
+                df.at[osgb_row[osgb], 'sa_polygon'] = None
                 df = remove_holes(df, polygon_within_hole)
 
             if rlp and osgb_touching:
                 for t in osgb_touching:
-                    t_polygon = df.loc[df['osgb'] ==
-                                       t, 'sa_polygon'].values[0]
-                    if t_polygon:
+                    t_polygon = df.at[osgb_row[t], 'sa_polygon']
+                    if t_polygon is not None:
                         t_polygon_within_hole = literal_eval(
-                            df.loc[df['osgb'] == t,
-                                   'sa_polygon_within_hole'].values[0])
-                        t_polygon = loads(t_polygon)
-                        osgb_polygon = df.loc[df['osgb'] == osgb,
-                                              'sa_polygon'].values[0]
-                        if osgb_polygon and t_polygon_within_hole and (osgb in t_polygon_within_hole):
+                            df.at[osgb_row[t], 'sa_polygon_within_hole'])
+                        osgb_polygon = df.at[osgb_row[osgb], 'sa_polygon']
+                        if osgb_polygon is not None and t_polygon_within_hole and (osgb in t_polygon_within_hole):
                             t_polygon = simplification_affects_inner_ring(
                                 t_polygon, polygon, rlp)
                         t_outer_coords = list(t_polygon.exterior.coords)
@@ -641,20 +1160,20 @@ def polygon_simplification(df, simplify_polygon_no):
                                     t_polygon_within_hole, rlp)
                             else:
                                 t_polygon = Polygon(t_outer_coords)
-                            df.loc[df['osgb'] == t, 'sa_polygon'] = dumps(
-                                t_polygon, rounding_precision=2)
+                            df.at[osgb_row[t], 'sa_polygon'] = round_coordinates(
+                                t_polygon)
                         else:
-                            df.loc[df['osgb'] == t, 'sa_polygon'] = False
+                            df.at[osgb_row[t], 'sa_polygon'] = None
                             df = remove_holes(df, t_polygon_within_hole)
             return df
 
+        osgb_row = osgb_index(df)
         osgb_list = df['osgb'].unique().tolist()
         for osgb in osgb_list:
-            if df.loc[df['osgb'] == osgb, 'sa_polygon_simplify'].values[0]:
+            if df.at[osgb_row[osgb], 'sa_polygon_simplify']:
                 osgb_touching = list()
-                polygon = df.loc[df['osgb'] == osgb, 'sa_polygon'].values[0]
-                if polygon:
-                    osgb_polygon = loads(polygon)
+                osgb_polygon = df.at[osgb_row[osgb], 'sa_polygon']
+                if osgb_polygon is not None:
                     osgb_touching = touching_poly(
                         df, osgb, osgb_polygon, osgb_list, osgb_touching)
                     df = polygon_simplifying(
@@ -678,14 +1197,12 @@ def polygon_simplification(df, simplify_polygon_no):
             coords = remove_duplicated_coords_from_list(coords)
             return coords
 
+        osgb_row = osgb_index(df)
         for row in df.itertuples():
-            polygon = loads(row.sa_polygon)
+            polygon = df.at[row.Index, 'sa_polygon']
             if not polygon.is_valid:
-                new_polygon = polygon.buffer(0)
-                df.loc[row.Index, 'sa_polygon'] = dumps(
-                    new_polygon, rounding_precision=2)
-                new_polygon = loads(
-                    dumps(new_polygon, rounding_precision=2))
+                new_polygon = round_coordinates(polygon.buffer(0))
+                df.at[row.Index, 'sa_polygon'] = new_polygon
                 osgb_touching = literal_eval(row.sa_initial_touching)
                 if osgb_touching:
                     new_coords = list(
@@ -694,23 +1211,21 @@ def polygon_simplification(df, simplify_polygon_no):
                         set(list(polygon.exterior.coords)) - set(list(new_polygon.exterior.coords)))
                     if new_coords:
                         for t in osgb_touching:
-                            t_polygon = loads(
-                                df.loc[df['osgb'] == t, 'sa_polygon'].values[0])
+                            t_polygon = df.at[osgb_row[t], 'sa_polygon']
                             t_polygon_coords = list(
                                 t_polygon.exterior.coords)
                             t_polygon_coords = remove_buffered_coordinates(
                                 t, t_polygon_coords, new_coords, removed_coords)
                             new_t_polygon = Polygon(t_polygon_coords,
                                                     t_polygon.interiors)
-                            df.loc[df['osgb'] == t, 'sa_polygon'] = dumps(
-                                new_t_polygon, rounding_precision=2)
+                            df.at[osgb_row[t], 'sa_polygon'] = round_coordinates(
+                                new_t_polygon)
         return df
 
     while simplify_polygon_no > 0:
         df = polygon_within_hole(df)
         df = polygon_simplify(df)
-        df = df.loc[~df['sa_polygon'].isin(
-            [False])].reset_index(drop=True)
+        df = df.loc[df['sa_polygon'].notna()].reset_index(drop=True)
         df = polygon_buffer(df)
         df = polygon_tolerance(df)
         simplify_polygon_no = df['sa_polygon_simplify'].sum()
@@ -834,14 +1349,13 @@ def collinear_exterior(df):
         new_polygon = update_polygon(polygon, collinear_points_list)
         return new_polygon
 
+    osgb_row = osgb_index(df)
     for row in df.itertuples():
         osgb_touching = literal_eval(row.sa_simplified_touching)
-        polygon = loads(row.sa_polygon)
-        osgb = row.osgb
+        polygon = df.at[row.Index, 'sa_polygon']
         if osgb_touching:
             for t in osgb_touching:
-                t_polygon = loads(
-                    df.loc[df['osgb'] == t, 'sa_polygon'].values[0])
+                t_polygon = df.at[osgb_row[t], 'sa_polygon']
                 partition = polygon.intersection(t_polygon)
                 if partition.geom_type == 'MultiLineString':
                     partition = linemerge(partition)
@@ -852,22 +1366,21 @@ def collinear_exterior(df):
                         polygon, partition_collinear_points)
                     t_polygon = update_polygon(
                         t_polygon, partition_collinear_points)
-                    df.loc[df['osgb'] == t, 'sa_polygon'] = dumps(
-                        t_polygon, rounding_precision=2)
-                    df.loc[df['osgb'] == osgb, 'sa_polygon'] = dumps(
-                        polygon, rounding_precision=2)
+                    df.at[osgb_row[t], 'sa_polygon'] = round_coordinates(
+                        t_polygon)
+                    df.at[row.Index, 'sa_polygon'] = round_coordinates(
+                        polygon)
 
+    exposed_list, horizontal_list = list(), list()
     for row in df.itertuples():
         osgb_touching = literal_eval(row.sa_simplified_touching)
-        polygon = loads(row.sa_polygon)
-        osgb = row.osgb
+        polygon = df.at[row.Index, 'sa_polygon']
         if osgb_touching:
             outer_ring = LineString(polygon.exterior)
             inner_ring = MultiLineString(polygon.interiors)
             exposed = unary_union((outer_ring, inner_ring))
             for t in osgb_touching:
-                t_polygon = loads(
-                    df.loc[df['osgb'] == t, 'sa_polygon'].values[0])
+                t_polygon = df.at[osgb_row[t], 'sa_polygon']
                 exposed -= polygon.intersection(t_polygon)
             exposed_collinear_points = collinear_points_list(exposed)
             if exposed_collinear_points:
@@ -881,12 +1394,11 @@ def collinear_exterior(df):
             inner_ring = MultiLineString(polygon.interiors)
             exposed = unary_union((outer_ring, inner_ring))
 
-        df.loc[df['osgb'] == osgb, 'sa_polygon_exposed_wall'] = dumps(
-            exposed, rounding_precision=2)
-        df.loc[df['osgb'] == osgb, 'sa_polygon'] = dumps(
-            polygon, rounding_precision=2)
-        df.loc[df['osgb'] == osgb, 'sa_polygon_horizontal'] = dumps(
-            horizontal, rounding_precision=2)
+        exposed_list.append(exposed)
+        df.at[row.Index, 'sa_polygon'] = round_coordinates(polygon)
+        horizontal_list.append(horizontal)
+    df['sa_polygon_exposed_wall'] = exposed_list
+    df['sa_polygon_horizontal'] = horizontal_list
     return df
 
 # END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
@@ -0,0 +1,109 @@
+"""
+/***************************************************************************
+ SimstockQGIS
+        copyright            : (C) 2023-2026 by UCL
+        email                : shyam.amrith.14@ucl.ac.uk
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import os
+import sys
+import shutil
+import platform
+import multiprocessing as mp
+
+
+# Windows only finds executables without their extension when searching the
+# PATH, not when given the path of the file
+WINDOWS = platform.system() == 'Windows'
+
+# Seconds a new worker process may take to start (import pandas, shapely
+# and eppy and run the initializer)
+WORKER_START_TIMEOUT = 120
+
+
+def resolve_executable(path):
+    '''
+    Function which returns the path of the executable file 'path' refers to,
+    adding '.exe' on Windows when the path has no extension. Returns None if
+    there is no such file
+    '''
+    candidates = [path]
+    if WINDOWS and not os.path.splitext(path)[1]:
+        candidates.insert(0, path + '.exe')
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def worker_python(python=None):
+    '''
+    Function which returns the python interpreter for spawned worker
+    processes. 'python' is the QGIS python found by the plugin (None on
+    Linux). Inside QGIS sys.executable is the QGIS program, which cannot run
+    the workers, so it is only used when it is a python interpreter itself
+    '''
+    if python is not None:
+        executable = resolve_executable(python)
+        if executable is None:
+            raise RuntimeError('The QGIS Python was not found at {}'.format(python))
+        return executable
+
+    if os.path.basename(sys.executable).lower().startswith('python'):
+        return sys.executable
+
+    # The python of the same version as the one running, next to it or on
+    # the PATH
+    version = 'python{}.{}'.format(*sys.version_info[:2])
+    names = [version, 'python3', 'python']
+    candidates = [resolve_executable(os.path.join(sys.exec_prefix, folder, name))
+                  for folder in ['bin', ''] for name in names]
+    candidates += [shutil.which(name) for name in names]
+    for candidate in candidates:
+        if candidate is not None:
+            return candidate
+    raise RuntimeError('No Python interpreter was found for the worker processes '
+                       '(looked for {} in {} and on the PATH)'.format(
+                           ', '.join(names), sys.exec_prefix))
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def spawn_pool(processes, python=None, initializer=None, initargs=()):
+    '''
+    Function which starts a pool of spawned worker processes running
+    worker_python(python). Spawn rather than fork since this may run inside
+    the QGIS process. A worker which dies while starting (e.g. the python
+    cannot import the modules, or the initializer fails) is replaced by the
+    pool over and over, so that the tasks would never finish. The pool is
+    therefore only returned once a worker has run a first task, and an error
+    is raised if none has after WORKER_START_TIMEOUT s. Workers dying later
+    on are not detected
+    '''
+    python = worker_python(python)
+    context = mp.get_context('spawn')
+    context.set_executable(python)
+    pool = context.Pool(processes, initializer=initializer, initargs=initargs)
+    try:
+        pool.apply_async(os.getpid).get(timeout=WORKER_START_TIMEOUT)
+    except mp.TimeoutError:
+        pool.terminate()
+        raise RuntimeError('The worker processes did not start within {} s. Check '
+                           'that {} can import the plugin modules, or set the '
+                           'number of cores to 1 in config.json'.format(
+                               WORKER_START_TIMEOUT, python))
+    return pool
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
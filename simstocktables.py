@@ -0,0 +1,106 @@
+"""
+/***************************************************************************
+ SimstockQGIS
+        copyright            : (C) 2023-2026 by UCL
+        email                : shyam.amrith.14@ucl.ac.uk
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import os
+import pandas as pd
+from shapely import wkb
+
+# Parquet needs pyarrow which is not bundled with every QGIS. Without it the
+# tables are pickled, which keeps the same column types but has to be read
+# whole
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+
+# Columns holding geometries (stored as WKB) and lists of osgb values
+GEOMETRY_COLUMNS = ['polygon', 'sa_polygon', 'sa_polygon_exposed_wall',
+                    'sa_polygon_horizontal']
+LIST_COLUMNS = ['sa_initial_touching', 'sa_simplified_touching',
+                'sa_collinear_touching']
+
+
+def table_file(directory, name):
+    '''
+    Function which returns the path of the table 'name' in 'directory'
+    '''
+    extension = 'parquet' if pq is not None else 'pkl'
+    return os.path.join(directory, '{}.{}'.format(name, extension))
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def write_table(df, directory, name):
+    '''
+    Function which writes a dataframe as a typed table. Geometry columns
+    (shapely objects) are stored as WKB, adjacency columns as lists and the
+    other text columns as categoricals
+    '''
+    df = df.copy()
+    for column in df.columns:
+        if column in GEOMETRY_COLUMNS:
+            df[column] = [None if g is None else g.wkb for g in df[column]]
+        elif column in LIST_COLUMNS:
+            df[column] = [list(value) for value in df[column]]
+        elif column != 'osgb' and df[column].dtype == object:
+            values = df[column].dropna()
+            if all(isinstance(value, str) for value in values):
+                df[column] = df[column].astype('category')
+    if pq is not None:
+        df.to_parquet(table_file(directory, name), index=False)
+    else:
+        df.to_pickle(table_file(directory, name))
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def read_table(directory, name, columns=None):
+    '''
+    Function which reads a table written by write_table. 'columns' is a list
+    of column names or a function which returns True for the names to read
+    (all columns if None). Geometries are returned as shapely objects and
+    adjacency columns as lists
+    '''
+    path = table_file(directory, name)
+    if pq is not None:
+        names = pq.read_schema(path).names
+    else:
+        df = pd.read_pickle(path)
+        names = list(df.columns)
+    if columns is None:
+        selected = names
+    elif callable(columns):
+        selected = [column for column in names if columns(column)]
+    else:
+        selected = [column for column in names if column in columns]
+    if pq is not None:
+        df = pd.read_parquet(path, columns=selected)
+    else:
+        df = df[selected].copy()
+
+    for column in df.columns:
+        if column in GEOMETRY_COLUMNS:
+            df[column] = [None if g is None else wkb.loads(bytes(g))
+                          for g in df[column]]
+        elif column in LIST_COLUMNS:
+            # Parquet returns arrays of numpy scalars
+            df[column] = [value.tolist() if hasattr(value, 'tolist')
+                          else list(value) for value in df[column]]
+    return df
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
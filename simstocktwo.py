@@ -16,18 +16,27 @@
 """
 
 import os
+import sys
 import math
 import platform
+import traceback
+from collections import deque
+import numpy as np
 import pandas as pd
-from ast import literal_eval
-from shapely.wkt import loads
-from eppy.modeleditor import IDF, IDDAlreadySetError
+from eppy.modeleditor import IDF
 from time import time, localtime, strftime
-from shapely.geometry import LineString, MultiLineString
+from shapely.geometry import LineString, MultiLineString, Polygon
+from shapely.geometry.polygon import orient
 from shapely.ops import unary_union
+from shapely.strtree import STRtree
+from shapely import __version__ as shapely_version
 import json
 from eppy.bunch_subclass import BadEPFieldError
 import logging
+from simstocktables import read_table, write_table
+from simstockidd import set_idd
+from simstockidf import IDFWriter
+from simstockprocess import spawn_pool
 
 
 ROOT_DIR = os.path.abspath(os.path.dirname(__file__))
@@ -35,15 +44,30 @@ EP_DIR = os.path.join(ROOT_DIR, 'EnergyPlus')
 #IDF_DIR = os.path.join(ROOT_DIR, 'idf_files')
 #os.makedirs(IDF_DIR, exist_ok=True)
 ep_basic_settings = os.path.join(ROOT_DIR, 'basic_settings.idf')
-input_data = os.path.join(ROOT_DIR, 'sa_preprocessed.csv')
+
+# Columns of the preprocessed data used to create the idfs (plus the
+# 'FLOOR_X: use' columns)
+input_columns = ['osgb', 'bi', 'shading', 'polygon', 'sa_polygon',
+                 'sa_polygon_exposed_wall', 'sa_polygon_horizontal',
+                 'sa_collinear_touching', 'height', 'wwr', 'nofloors',
+                 'wall_const', 'roof_const', 'floor_const', 'glazing_const',
+                 'overhang_depth', 'ventilation_rate', 'infiltration_rate']
 
 # Do not place window if the wall width is less than this number
 min_avail_width_for_window = 1
 # Do not place window if partially exposed external wall is less than this number % of zone height
 min_avail_height = 80
 
+# Idf of the basic settings parsed once per process and the snapshot used to
+# restore it for each BI (see basic_settings_idf)
+basic_settings = None
+basic_settings_snapshot = None
+
+# Shapely 2.x STRtree queries return indices and accept arrays of geometries
+SHAPELY_2 = int(shapely_version.split('.')[0]) >= 2
 
-def main(idf_dir):
+
+def main(idf_dir, python=None):
     # User set cwd from main script
     IDF_DIR = idf_dir
     os.makedirs(IDF_DIR, exist_ok=True)
@@ -59,158 +83,85 @@ def main(idf_dir):
     system = platform.system().lower()
     if system in ['windows', 'linux', 'darwin']:
         iddfile = os.path.join(EP_DIR, 'ep8.9_{}/Energy+.idd'.format(system))
-    try:
-        IDF.setiddname(iddfile) #not needed due to prior setup fns setting idd
-    except IDDAlreadySetError:
-        pass
-    idf = IDF(ep_basic_settings)
+    set_idd(iddfile) #not needed due to prior setup fns setting idd
 
     # Load input data (preprocessing outputs)
-    df = pd.read_csv(input_data, dtype={'construction':str})
+    df = read_table(ROOT_DIR, 'sa_preprocessed',
+                    columns=lambda column: column in input_columns or column.startswith('FLOOR_'))
+
+    # Index rows by osgb so that adjacent objects are looked up directly
+    # rather than by scanning the osgb column
+    df = df.set_index('osgb', drop=False).rename_axis(None)
 
     # Load config file
     with open(os.path.join(ROOT_DIR, "config.json"), "r") as read_file:
         config = json.load(read_file)
     
-    # Function which creates the idf(s)
-    def createidfs(bi_df, df, mode):
-    
-        # Move all objects towards origins
-        origin = loads(bi_df['sa_polygon'].iloc[0])
-        origin = list(origin.exterior.coords[0])
-        origin.append(0)
-
-        # Shading volumes converted to shading objects
-        shading_df = bi_df.loc[bi_df['shading'] == True]
-        shading_df.apply(shading_volumes, args=(df, idf, origin,), axis=1)
-
-        # Polygons with zones converted to thermal zones based on floor number
-        zones_df = bi_df.loc[bi_df['shading'] == False]
-        zone_use_dict = {} #mixed-use for plugin ###############################
-        zones_df.apply(thermal_zones, args=(bi_df, idf, origin, zone_use_dict,), axis=1)
-
-        # Extract names of thermal zones:
-        zones = idf.idfobjects['ZONE']
-        zone_names = list()
-        for zone in zones:
-            zone_names.append(zone.Name)
-
-        # Create a 'Dwell' zone list with all thermal zones. "Dwell" apears
-        # in all objects which reffer to all zones (thermostat, people, etc.)
-        #idf.newidfobject('ZONELIST', Name='List')
-        #objects = idf.idfobjects['ZONELIST'][-1]
-        #for i, zone in enumerate(zone_names):
-        #    exec('objects.Zone_%s_Name = zone' % (i + 1))
-        
-        ########################################################################
-        # Plugin feature: mixed-use
-        mixed_use(idf, zone_use_dict)
-        ########################################################################
-
-        # Ideal loads system
-        for zone in zone_names:
-            system_name = '{}_HVAC'.format(zone)
-            eq_name = '{}_Eq'.format(zone)
-            supp_air_node = '{}_supply'.format(zone)
-            air_node = '{}_air_node'.format(zone)
-            ret_air_node = '{}_return'.format(zone)
-
-            idf.newidfobject('ZONEHVAC:IDEALLOADSAIRSYSTEM',
-                                Name=system_name,
-                                Zone_Supply_Air_Node_Name=supp_air_node,
-                                Dehumidification_Control_Type='None')
-
-            idf.newidfobject('ZONEHVAC:EQUIPMENTLIST',
-                                Name=eq_name,
-                                Zone_Equipment_1_Object_Type='ZONEHVAC:IDEALLOADSAIRSYSTEM',
-                                Zone_Equipment_1_Name=system_name,
-                                Zone_Equipment_1_Cooling_Sequence=1,
-                                Zone_Equipment_1_Heating_or_NoLoad_Sequence=1)
-
-            idf.newidfobject('ZONEHVAC:EQUIPMENTCONNECTIONS',
-                                Zone_Name=zone,
-                                Zone_Conditioning_Equipment_List_Name=eq_name,
-                                Zone_Air_Inlet_Node_or_NodeList_Name=supp_air_node,
-                                Zone_Air_Node_Name=air_node,
-                                Zone_Return_Air_Node_or_NodeList_Name=ret_air_node)
-
-            ####################################################################
-            # Plugin feature: fields sourced from attribute table
-            # TODO: streamline this by putting in functions          
-
-            def get_osgb_value(val_name, zones_df, zone):
-                """Gets the value of a specified attribute for the zone"""
-                osgb_from_zone = "_".join(zone.split("_")[:-2])
-                return zones_df[zones_df["osgb"]==osgb_from_zone][val_name].to_numpy()[0]
-
-            # Get specified inputs for zone
-            ventilation_rate = get_osgb_value("ventilation_rate", zones_df, zone)
-            infiltration_rate = get_osgb_value("infiltration_rate", zones_df, zone)
-
-            # Get the rest of the default obj values from dict
-            zone_ventilation_dict = ventilation_dict
-            zone_infiltration_dict = infiltration_dict
-
-            # Set the name, zone name and ventilation rate
-            zone_ventilation_dict["Name"] = zone + "_ventilation"
-            zone_ventilation_dict["Zone_or_ZoneList_Name"] = zone
-            zone_ventilation_dict["Air_Changes_per_Hour"] = ventilation_rate
-            zone_ventilation_dict["Schedule_Name"] = zone_use_dict[zone] + "_Occ"
-            zone_ventilation_dict["Minimum_Indoor_Temperature"] = float(config["Ventilation minimum temperature"])
-
-            # Same for infiltration
-            zone_infiltration_dict["Name"] = zone + "_infiltration"
-            zone_infiltration_dict["Zone_or_ZoneList_Name"] = zone
-            zone_infiltration_dict["Air_Changes_per_Hour"] = infiltration_rate
-
-            # Add the ventilation idf object
-            idf.newidfobject(**zone_ventilation_dict)
-            idf.newidfobject(**zone_infiltration_dict)
-            ####################################################################
-        
-        #if mode == "single":
-        #    idf.saveas(os.path.join(IDF_DIR, '{}.idf'.format(datafilename)))
-        #elif mode == "bi":
-        #    idf.saveas(os.path.join(BI_IDF_DIR, '{}.idf'.format(bi)))
-        idf.saveas(os.path.join(IDF_DIR, '{}.idf'.format(bi)))
 
     # Check whether in built island mode and create idf(s) accordingly
     #if args.builtisland:
         #print("Splitting output data into built islands")
         #os.makedirs(BI_IDF_DIR, exist_ok=True)
     bi_list = df['bi'].unique().tolist()
-        
-    for bi in bi_list:
-        idf = IDF(ep_basic_settings)
-        # Change the name field of the building object
-        building_object = idf.idfobjects['BUILDING'][0]
-        building_object.Name = bi
-        
-        # Get the data for the BI
-        bi_df = df[df['bi'] == bi]
 
-        # Get the data for other BIs to use as shading
-        rest  = df[df['bi'] != bi]
+    # Number of processes used to create the idfs
+    cores = int(config.get("Geometry cores", 1))
+    jobs = []
 
-        # Shading buffer with specified radius
-        buffer_radius = float(config["Shading buffer radius - m"])
+    # Shading buffer with specified radius
+    buffer_radius = float(config["Shading buffer radius - m"])
 
-        # Buffer the BI geometry to specified radius
-        bi_geom = list(map(loads, bi_df.polygon.to_numpy()))
-        buffer = unary_union(bi_geom).convex_hull.buffer(buffer_radius)
+    if config.get("Zone multipliers - experimental", "false").lower() == "true":
+        print('Zone multipliers are experimental: the heating and cooling of '
+              'grouped floors are not yet verified', flush=True)
 
-        # Find polygons which are within this buffer and create mask
-        lst = []
-        index = []
-        for row in rest.itertuples():
-            poly = loads(row.sa_polygon)
-            # The following is True if poly intersects buffer and False if not
-            lst.append(poly.intersects(buffer))
-            index.append(row.Index)
-        mask = pd.Series(lst, index=index)
+    # Split the data into BIs once
+    bi_groups = dict(list(df.groupby('bi', sort=False, observed=True)))
 
-        # Get data for the polygons within the buffer
-        within_buffer = rest.loc[mask].copy()
+    # BIs with more thermal zones than the budget (no limit if 0) are split
+    # along party walls into parts which are simulated separately. Each idf
+    # is named after its BI or '<BI>_part<n>' and holds the rows of 'osgbs'
+    # (all rows of the BI if None)
+    max_zones = int(config.get("Maximum zones per idf", 0))
+    models = list()
+    for bi in bi_list:
+        parts = split_built_island(bi_groups[bi], max_zones)
+        if len(parts) == 1:
+            models.append((bi, bi, None))
+        else:
+            print('Splitting {} into {} idfs'.format(bi, len(parts)), flush=True)
+            models.extend(('{}_part{}'.format(bi, n), bi, part)
+                          for n, part in enumerate(parts, start=1))
+
+    # Buffer the geometry of each BI (or part) to specified radius
+    buffers = list()
+    for _, bi, osgbs in models:
+        polygons = bi_groups[bi]['polygon']
+        if osgbs is not None:
+            polygons = polygons.loc[osgbs]
+        buffers.append(unary_union(polygons.tolist()).convex_hull.buffer(buffer_radius))
+
+    # Find the polygons within each buffer with a single query of a spatial
+    # index over all polygons
+    candidates = intersecting_polygons(buffers, df['sa_polygon'].tolist())
+    bi_values = df['bi'].to_numpy()
+    osgb_values = df.index.to_numpy()
+    idf_files = list()
+
+    for (name, bi, osgbs), positions in zip(models, candidates):
+        # Get the data for the BI
+        bi_df = bi_groups[bi]
+
+        # Get data for the polygons of other BIs within the buffer. The other
+        # parts of a split BI are shading as well, so that the party walls
+        # towards them are adiabatic
+        if osgbs is None:
+            positions = [i for i in positions if bi_values[i] != bi]
+        else:
+            part = set(osgbs)
+            bi_df = bi_df.loc[osgbs]
+            positions = [i for i in positions if osgb_values[i] not in part]
+        within_buffer = df.iloc[positions].copy()
 
         # Set them to be shading
         within_buffer["shading"] = True
@@ -220,11 +171,25 @@ def main(idf_dir):
         
         # Only create idf if the BI is not entirely composed of shading blocks
         shading_vals = bi_df['shading'].to_numpy()
-        if not shading_vals.all():
-            createidfs(bi_df, df, "bi")
-        else:
+        if shading_vals.all():
             continue
-            
+
+        # Only the rows of the BI, its shading and the objects adjacent to
+        # the shading are needed to create the idf
+        job = (name, bi_df, adjacent_objects(bi_df, df), IDF_DIR, config)
+        idf_files.append((bi, name))
+        if cores > 1:
+            jobs.append(job)
+        else:
+            createidfs(*job)
+
+    if jobs:
+        parallel_idfs(jobs, cores, iddfile, python)
+
+    # List of the idfs created for each BI, which are the ones simulated
+    write_table(pd.DataFrame(idf_files, columns=['bi', 'idf']), ROOT_DIR,
+                'sa_idf_files')
+
     #else:
     #    # Change the name field of the building object
     #    building_object = idf.idfobjects['BUILDING'][0]
@@ -235,6 +200,367 @@ def main(idf_dir):
 
 # END OF MAIN  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
+
+def createidfs(bi, bi_df, df, idf_dir, config):
+    '''
+    Function which creates and saves the idf of built island 'bi' (or of a
+    part of a split BI). 'bi_df' holds the rows of the BI and its shading,
+    'df' the objects they are adjacent to (indexed by osgb)
+    '''
+    idf = basic_settings_idf()
+    # Write the new objects straight to idf text rather than through eppy
+    if config.get("Streaming idf writer", "true").lower() == "true":
+        idf = IDFWriter(idf)
+    # Change the name field of the building object
+    building_object = idf.idfobjects['BUILDING'][0]
+    building_object.Name = bi
+
+    # Move all objects towards origins
+    origin = bi_df['sa_polygon'].iloc[0]
+    origin = list(origin.exterior.coords[0])
+    origin.append(0)
+
+    # Shading further than the far shading distance from the thermal zones
+    # is merged into simplified envelopes (all shading is detailed if 0)
+    far_distance = float(config.get("Far shading distance - m", 0))
+    if far_distance > 0:
+        bi_df, far_df = far_shading(bi_df, far_distance)
+
+    # Party walls between the objects of the BI and their adjacent objects
+    party_wall_dict = party_walls(bi_df, df, origin)
+
+    # Shading volumes converted to shading objects
+    shading_df = bi_df.loc[bi_df['shading'] == True]
+    shading_df.apply(shading_volumes, args=(party_wall_dict, idf, origin,),
+                     axis=1)
+    if far_distance > 0 and len(far_df):
+        tolerance = float(config.get("Far shading tolerance - m", 1))
+        envelope_surfaces = shading_envelopes(idf, far_df, origin, tolerance)
+        print('{}: {} far shading polygons (about {} shading surfaces) merged '
+              'into {} envelope surfaces'.format(
+                  bi, len(far_df), detailed_shading_surfaces(far_df),
+                  envelope_surfaces), flush=True)
+
+    # Polygons with zones converted to thermal zones based on floor number
+    zones_df = bi_df.loc[bi_df['shading'] == False]
+    zone_use_dict = {} #mixed-use for plugin ###############################
+    zone_multipliers = config.get("Zone multipliers - experimental",
+                                  "false").lower() == "true"
+    zones_df.apply(thermal_zones,
+                   args=(party_wall_dict, idf, origin, zone_use_dict,
+                         zone_multipliers,), axis=1)
+
+    # Extract names of thermal zones (in the order they were created)
+    zone_names = list(zone_use_dict)
+
+    # Create a 'Dwell' zone list with all thermal zones. "Dwell" apears
+    # in all objects which reffer to all zones (thermostat, people, etc.)
+    #idf.newidfobject('ZONELIST', Name='List')
+    #objects = idf.idfobjects['ZONELIST'][-1]
+    #for i, zone in enumerate(zone_names):
+    #    exec('objects.Zone_%s_Name = zone' % (i + 1))
+    
+    ########################################################################
+    # Plugin feature: mixed-use
+    mixed_use(idf, zone_use_dict)
+    ########################################################################
+
+    # Ideal loads system
+    for zone in zone_names:
+        system_name = '{}_HVAC'.format(zone)
+        eq_name = '{}_Eq'.format(zone)
+        supp_air_node = '{}_supply'.format(zone)
+        air_node = '{}_air_node'.format(zone)
+        ret_air_node = '{}_return'.format(zone)
+
+        idf.newidfobject('ZONEHVAC:IDEALLOADSAIRSYSTEM',
+                            Name=system_name,
+                            Zone_Supply_Air_Node_Name=supp_air_node,
+                            Dehumidification_Control_Type='None')
+
+        idf.newidfobject('ZONEHVAC:EQUIPMENTLIST',
+                            Name=eq_name,
+                            Zone_Equipment_1_Object_Type='ZONEHVAC:IDEALLOADSAIRSYSTEM',
+                            Zone_Equipment_1_Name=system_name,
+                            Zone_Equipment_1_Cooling_Sequence=1,
+                            Zone_Equipment_1_Heating_or_NoLoad_Sequence=1)
+
+        idf.newidfobject('ZONEHVAC:EQUIPMENTCONNECTIONS',
+                            Zone_Name=zone,
+                            Zone_Conditioning_Equipment_List_Name=eq_name,
+                            Zone_Air_Inlet_Node_or_NodeList_Name=supp_air_node,
+                            Zone_Air_Node_Name=air_node,
+                            Zone_Return_Air_Node_or_NodeList_Name=ret_air_node)
+
+        ####################################################################
+        # Plugin feature: fields sourced from attribute table
+        # TODO: streamline this by putting in functions          
+
+        def get_osgb_value(val_name, zones_df, zone):
+            """Gets the value of a specified attribute for the zone"""
+            osgb_from_zone = "_".join(zone.split("_")[:-2])
+            return zones_df.at[osgb_from_zone, val_name]
+
+        # Get specified inputs for zone
+        ventilation_rate = get_osgb_value("ventilation_rate", zones_df, zone)
+        infiltration_rate = get_osgb_value("infiltration_rate", zones_df, zone)
+
+        # Get the rest of the default obj values from dict
+        zone_ventilation_dict = ventilation_dict
+        zone_infiltration_dict = infiltration_dict
+
+        # Set the name, zone name and ventilation rate
+        zone_ventilation_dict["Name"] = zone + "_ventilation"
+        zone_ventilation_dict["Zone_or_ZoneList_Name"] = zone
+        zone_ventilation_dict["Air_Changes_per_Hour"] = ventilation_rate
+        zone_ventilation_dict["Schedule_Name"] = zone_use_dict[zone] + "_Occ"
+        zone_ventilation_dict["Minimum_Indoor_Temperature"] = float(config["Ventilation minimum temperature"])
+
+        # Same for infiltration
+        zone_infiltration_dict["Name"] = zone + "_infiltration"
+        zone_infiltration_dict["Zone_or_ZoneList_Name"] = zone
+        zone_infiltration_dict["Air_Changes_per_Hour"] = infiltration_rate
+
+        # Add the ventilation idf object
+        idf.newidfobject(**zone_ventilation_dict)
+        idf.newidfobject(**zone_infiltration_dict)
+        ####################################################################
+    
+    #if mode == "single":
+    #    idf.saveas(os.path.join(IDF_DIR, '{}.idf'.format(datafilename)))
+    #elif mode == "bi":
+    #    idf.saveas(os.path.join(BI_IDF_DIR, '{}.idf'.format(bi)))
+    idf.saveas(os.path.join(idf_dir, '{}.idf'.format(bi)))
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def basic_settings_idf():
+    '''
+    Function which returns the idf of the basic settings to build a BI on.
+    The basic settings file is only parsed the first time. Afterwards the
+    same idf is restored from its snapshot: objects added for the previous
+    BI are dropped and removed or edited ones are put back as they were
+    '''
+    global basic_settings, basic_settings_snapshot
+    if basic_settings is None:
+        basic_settings = IDF(ep_basic_settings)
+        basic_settings_snapshot = idf_snapshot(basic_settings)
+    else:
+        restore_idf(basic_settings, basic_settings_snapshot)
+    return basic_settings
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def idf_snapshot(idf):
+    '''
+    Function which records the objects of an idf and their field values
+    '''
+    snapshot = dict()
+    for key, objects in idf.idfobjects.items():
+        snapshot[key] = [(bunch, list(bunch.obj)) for bunch in objects]
+    return snapshot
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def restore_idf(idf, snapshot):
+    '''
+    Function which returns an idf to the state recorded by idf_snapshot. The
+    lists are changed in place since the idf objects (bunches) and the model
+    data share them
+    '''
+    for key, objects in idf.idfobjects.items():
+        bunches = snapshot[key]
+        objects.list1[:] = [bunch for bunch, _ in bunches]
+        objects.list2[:] = [bunch.obj for bunch, _ in bunches]
+        for bunch, fields in bunches:
+            bunch.obj[:] = fields
+            bunch.theidf = idf
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def adjacent_objects(bi_df, df):
+    '''
+    Function which returns the polygon and height (indexed by osgb) of the
+    objects of 'bi_df' and of everything adjacent to its shading objects,
+    which is all that the idf geometry functions look up in 'df'
+    '''
+    shading_df = bi_df.loc[bi_df['shading'] == True]
+    osgbs = dict.fromkeys(bi_df.index)
+    for adj_osgb_list in shading_df['sa_collinear_touching']:
+        osgbs.update(dict.fromkeys(adj_osgb_list))
+    return df.loc[list(osgbs), ['sa_polygon', 'height']]
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def split_built_island(bi_df, max_zones):
+    '''
+    Function which splits the thermal zones of a BI into parts of at most
+    'max_zones' zones (if possible) along party walls. The adjacency graph
+    of the BI (sa_collinear_touching) is bisected until each part is within
+    the budget: polygons are ordered by a breadth first search starting from
+    a polygon at the end of the BI and cut where half of the zones are on
+    each side. For the long terraces which make up large BIs this gives
+    connected parts of balanced size, cut across few party walls. Returns a
+    list of lists of osgb (a single list if the BI is not split)
+    '''
+    zones_df = bi_df.loc[bi_df['shading'] == False]
+    weights = dict(zip(zones_df.index, zones_df['nofloors'].astype(int)))
+    if max_zones <= 0 or sum(weights.values()) <= max_zones:
+        return [list(bi_df.index)]
+    # Adjacent polygons with thermal zones within the BI
+    adjacency = {osgb: [adj_osgb for adj_osgb in adj_osgb_list
+                        if adj_osgb in weights]
+                 for osgb, adj_osgb_list in zip(
+                     zones_df.index, zones_df['sa_collinear_touching'])}
+
+    def bisect(osgbs):
+        total = sum(weights[osgb] for osgb in osgbs)
+        if total <= max_zones or len(osgbs) == 1:
+            return [osgbs]
+        # Start from the polygon found last by a search from the first one,
+        # which is at one end of the (first connected piece of the) BI
+        start = graph_components(osgbs, adjacency, osgbs[0])[0][-1]
+        order = [osgb for component in
+                 graph_components(osgbs, adjacency, start)
+                 for osgb in component]
+        # Cut where the number of zones on each side is closest to half
+        cumulative = np.cumsum([weights[osgb] for osgb in order])
+        cut = int(np.argmin(np.abs(cumulative[:-1] - total / 2))) + 1
+        return bisect(order[:cut]) + bisect(order[cut:])
+
+    parts = [set(part) for part in bisect(list(weights))]
+    # Keep the rows of each part in the order of the BI
+    return [[osgb for osgb in zones_df.index if osgb in part]
+            for part in parts]
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def graph_components(osgbs, adjacency, start):
+    '''
+    Function which returns the connected components of the graph of 'osgbs'
+    (edges from 'adjacency') as lists in breadth first search order. The
+    first component is the one of 'start'
+    '''
+    members = set(osgbs)
+    seen = set()
+    components = list()
+    for root in [start] + list(osgbs):
+        if root in seen:
+            continue
+        seen.add(root)
+        component = list()
+        queue = deque([root])
+        while queue:
+            osgb = queue.popleft()
+            component.append(osgb)
+            for adj_osgb in adjacency[osgb]:
+                if adj_osgb in members and adj_osgb not in seen:
+                    seen.add(adj_osgb)
+                    queue.append(adj_osgb)
+        components.append(component)
+    return components
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def intersecting_polygons(buffers, polygons):
+    '''
+    Function which queries an STRtree spatial index over 'polygons' for the
+    polygons intersecting each of 'buffers'. Returns a sorted list of
+    polygon positions for each buffer
+    '''
+    candidates = [list() for _ in buffers]
+    if not polygons:
+        return candidates
+    tree = STRtree(polygons)
+    if SHAPELY_2:
+        buffer_positions, positions = tree.query(buffers, predicate='intersects')
+        for i, j in zip(buffer_positions.tolist(), positions.tolist()):
+            candidates[i].append(j)
+    else:
+        # Shapely 1.x returns the geometries with intersecting bounding boxes
+        position = {id(polygon): j for j, polygon in enumerate(polygons)}
+        for i, buffer in enumerate(buffers):
+            candidates[i] = [position[id(polygon)] for polygon in tree.query(buffer)
+                             if polygon.intersects(buffer)]
+    return [sorted(positions) for positions in candidates]
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def parallel_idfs(jobs, cores, iddfile, python=None):
+    '''
+    Function which runs createidfs for each built island in a pool of
+    processes. The idf of each BI is named after the BI, so the outputs do
+    not depend on the order in which the workers finish. Errors are collected
+    per BI and raised together once all BIs are done. 'python' is the
+    interpreter used for the worker processes (the QGIS python when run from
+    the plugin)
+    '''
+    print('Creating {} idfs on {} cores'.format(len(jobs), cores), flush=True)
+
+    with spawn_pool(min(cores, len(jobs)), python, initializer=idf_worker_init,
+                    initargs=(eppy_paths(), iddfile)) as pool:
+        errors = [error for error in pool.imap(idf_worker, jobs)
+                  if error is not None]
+
+    if errors:
+        raise RuntimeError('Failed to create the idfs of {} built island(s):\n\n{}'
+                           .format(len(errors), '\n'.join(errors)))
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def idf_worker_init(paths, iddfile):
+    '''
+    Function which prepares a worker process of parallel_idfs: makes the
+    bundled eppy and its dependencies importable and sets the E+ idd file
+    '''
+    for path in paths:
+        if path not in sys.path:
+            sys.path.append(path)
+    set_idd(iddfile)
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def idf_worker(job):
+    '''
+    Function which runs createidfs for one built island in a worker process.
+    Returns None on success or the error message of the BI
+    '''
+    try:
+        createidfs(*job)
+    except Exception:
+        return '{}:\n{}'.format(job[0], traceback.format_exc())
+    return None
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def eppy_paths():
+    '''
+    Function which returns the directories of the bundled eppy, munch and
+    decorator packages (the same ones the plugin puts on sys.path)
+    '''
+    scripts_dir = os.path.join(ROOT_DIR, 'eppy-scripts')
+    # Use eppy 5.56 if Python version <= 3.9 else use eppy 5.63
+    if sys.version_info[:2] <= (3, 9):
+        eppy_dir = os.path.join(scripts_dir, 'eppy556')
+    else:
+        eppy_dir = os.path.join(scripts_dir, 'eppy563')
+    return [eppy_dir, os.path.join(scripts_dir, 'munch250'),
+            os.path.join(scripts_dir, 'decorator511')]
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
 def mixed_use(idf, zone_use_dict):
 
     # Check for missing values
@@ -251,10 +577,9 @@ def mixed_use(idf, zone_use_dict):
         for key, value in zone_use_dict.items():
             if value.lower() == use:
                 zone_list.append(key)
-        idf.newidfobject('ZONELIST', Name=use)
-        objects = idf.idfobjects['ZONELIST'][-1]
-        for i, zone in enumerate(zone_list):
-            exec('objects.Zone_%s_Name = zone' % (i + 1))
+        zone_fields = {'Zone_{}_Name'.format(i + 1): zone
+                       for i, zone in enumerate(zone_list)}
+        idf.newidfobject('ZONELIST', Name=use, **zone_fields)
     
     objects_to_delete = list()
     for obj in ['PEOPLE', 'LIGHTS', 'ELECTRICEQUIPMENT',
@@ -293,22 +618,64 @@ def pt(printout, pst):
 # END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
-def shading_volumes(row, df, idf, origin):
+def party_walls(bi_df, df, origin):
+    '''
+    Function which computes the party walls of the objects of 'bi_df' once
+    per pair of adjacent objects, instead of once per floor and side. Returns
+    a dictionary keyed by (osgb, adjacent osgb) holding the wall coordinates
+    relative to origin, as seen from osgb, and the height of the adjacent
+    object (looked up in 'df')
+    '''
+    party_wall_dict = dict()
+    for osgb, polygon, height, adj_osgb_list in zip(
+            bi_df.index, bi_df['sa_polygon'], bi_df['height'],
+            bi_df['sa_collinear_touching']):
+        for adj_osgb in adj_osgb_list:
+            # Already computed from the side of the adjacent object
+            if (osgb, adj_osgb) in party_wall_dict:
+                continue
+            # Find the intersection between two polygons (it will be
+            # LineString or MultiLineString) and position coordinates
+            # relative to origin
+            adj_polygon = df.at[adj_osgb, 'sa_polygon']
+            part_wall_polygon = polygon.intersection(adj_polygon)
+            coordinates = surface_coordinates(part_wall_polygon, origin)
+            party_wall_dict[(osgb, adj_osgb)] = (
+                coordinates, df.at[adj_osgb, 'height'])
+            # The adjacent object sees the same wall in the opposite direction
+            party_wall_dict[(adj_osgb, osgb)] = (
+                reversed_coordinates(coordinates), height)
+    return party_wall_dict
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def reversed_coordinates(coordinates_list):
+    '''
+    Function which reverses a list of coordinates lists, together with the
+    order of the ordered pairs in each of them
+    '''
+    return [coordinates[::-1] for coordinates in coordinates_list[::-1]]
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def shading_volumes(row, party_wall_dict, idf, origin):
     '''
     Function which generates idf geometry for surrounding Build Blocks. All
     elements are converted to shading objects
     '''
-    # Polygon name and coordinates
-    osgb, polygon = row.osgb, loads(row.sa_polygon)
+    # Polygon name
+    osgb = row.osgb
     # Polygon with removed collinear point to be used for ceiling/floor/roof
     hor_polygon = row.sa_polygon_horizontal
     # Convert polygon coordinates to dictionary of outer and inner
     # (if any) coordinates
     hor_poly_coord_dict = polygon_coordinates_dictionary(hor_polygon)
     # List of adjacent polygons
-    adj_osgb_list = literal_eval(str(row.sa_collinear_touching))
-    # Load the polygon which defines only external surfaces
-    ext_surf_polygon = loads(row.sa_polygon_exposed_wall)
+    adj_osgb_list = row.sa_collinear_touching
+    # Polygon which defines only external surfaces
+    ext_surf_polygon = row.sa_polygon_exposed_wall
     # List of external surface only coordinates (ext_surf_polygon +
     # inner rings)
     ext_surf_coord = surface_coordinates(ext_surf_polygon, origin)
@@ -324,19 +691,89 @@ def shading_volumes(row, df, idf, origin):
     # Create external walls
     adiabatic_external_walls(idf, osgb, ext_surf_coord, zone_ceiling_h,
                              zone_floor_h, adiabatic_wall_name,
-                             adj_osgb_list, df, polygon, origin)
+                             adj_osgb_list, party_wall_dict)
     return
 
 # END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
+def far_shading(bi_df, far_distance):
+    '''
+    Function which separates the shading objects further than 'far_distance'
+    from the thermal zones of 'bi_df'. Returns the rows of 'bi_df' without
+    them and the far shading rows
+    '''
+    zones = unary_union(
+        bi_df.loc[bi_df['shading'] == False, 'sa_polygon'].tolist())
+    far = [shading and polygon.distance(zones) > far_distance
+           for shading, polygon in zip(bi_df['shading'], bi_df['sa_polygon'])]
+    far = np.array(far, dtype=bool)
+    return bi_df.loc[~far], bi_df.loc[far]
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def shading_envelopes(idf, far_df, origin, tolerance):
+    '''
+    Function which generates one simplified shading envelope per BI of the
+    far shading objects. Their polygons are merged, the outline simplified to
+    'tolerance' and extruded to the area weighted mean height of the objects
+    (courtyards are filled in). Returns the number of shading elements
+    '''
+    shading_surfaces = list()
+    for bi, group in far_df.groupby('bi', sort=False, observed=True):
+        polygons = group['sa_polygon'].tolist()
+        areas = np.array([polygon.area for polygon in polygons])
+        height = float(np.sum(areas * group['height'].to_numpy(dtype=float))
+                       / np.sum(areas))
+        merged = unary_union(polygons).simplify(tolerance,
+                                                preserve_topology=True)
+        outlines = getattr(merged, 'geoms', [merged])
+        for n, outline in enumerate(outlines, start=1):
+            if outline.is_empty or outline.geom_type != 'Polygon':
+                continue
+            # Exterior in the same (clockwise) orientation as the polygons
+            outline = orient(Polygon(outline.exterior), sign=-1.0)
+            envelope_name = '{}_Envelope{}'.format(bi, n)
+            coordinates = coordinates_move_origin([outline.exterior.coords],
+                                                  origin)
+            # Envelope walls
+            wall_coordinates = wall_vertices(coordinates, height, 0)
+            for wcc, wall in zip(wall_centre_coordinates(wall_coordinates),
+                                 wall_coordinates.tolist()):
+                shading_surfaces.append(shading_building_fields(
+                    envelope_name + '_Wall_' + wcc, wall))
+            # Envelope roof
+            roof_coordinates = idf_ceiling_coordinates_list(
+                coordinates_add_height(height, coordinates))
+            shading_surfaces.extend(
+                shading_building_fields(envelope_name + '_Roof', roof)
+                for roof in roof_coordinates)
+    # Creates the shading elements together
+    idf.newidfobjects('Shading:Building:Detailed'.upper(), shading_surfaces)
+    return len(shading_surfaces)
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def detailed_shading_surfaces(far_df):
+    '''
+    Function which estimates the number of shading elements shading_volumes
+    creates for 'far_df': one wall per ring segment and a roof per object
+    '''
+    segments = sum(len(polygon.exterior.coords) - 1 +
+                   sum(len(ring.coords) - 1 for ring in polygon.interiors)
+                   for polygon in far_df['sa_polygon'])
+    return segments + len(far_df)
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
 def polygon_coordinates_dictionary(polygon):
     '''
     Function which stores data form POLYGON((,,,),(,,,),(,,,)) in dictionary.
     Data are in the shape Polygon(exterior[, interiors=None])
    '''
-    # Load the polygon data by using shapely
-    polygon = loads(polygon)
     # Empty dictionary
     polygon_coordinates_dict = dict()
     # Outer ring (exterior) coordinates
@@ -383,29 +820,43 @@ def surface_coordinates(polygon, origin):
 
 def coordinates_move_origin(coordinates_list, origin):
     '''
-    Function which positions a coordinates relative to the origin
+    Function which positions a coordinates relative to the origin. Each
+    coordinates list is returned as an array of ordered pairs (n, 2)
    '''
     coordinates_list_moved_origin = list()
+    origin = np.array(origin[:2], dtype=float)
     # Loop through the list of coordinates
     for coordinates in coordinates_list:
-        # Empty list which to hold coordinates
-        coordinates_moved_origin = list()
-        # Loop through coordinates
-        for ordered_pair in coordinates:
-            # Position ordered pairs relative to origin
-            ordered_pair_moved_origin = [i - j for i, j in zip(ordered_pair,
-                                                               origin)]
-            # Round ordered pairs to 2 decimal spaces
-            ordered_pair_moved_origin = [
-                round(coord, 2) for coord in ordered_pair_moved_origin]
-            coordinates_moved_origin.append(ordered_pair_moved_origin)
-        coordinates_list_moved_origin.append(coordinates_moved_origin)
-    # Return list of coordinates converted to text strings
+        # Position ordered pairs relative to origin
+        ordered_pairs = np.array(coordinates, dtype=float).reshape(-1, 2)
+        ordered_pairs = ordered_pairs - origin
+        # Round ordered pairs to 2 decimal spaces
+        coordinates_list_moved_origin.append(round_coordinates(ordered_pairs))
+    # Return list of coordinates arrays
     return coordinates_list_moved_origin
 
 # END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
+def round_coordinates(coordinates, decimals=2):
+    '''
+    Function which rounds an array of coordinates to 'decimals' decimal spaces
+    with the same result as python's round. Numpy rounds the coordinates
+    multiplied by 10 ** decimals, which can round the other way when a
+    coordinate is half way between two decimals, so those are rounded by
+    python
+    '''
+    rounded = np.round(coordinates, decimals)
+    scaled = coordinates * 10 ** decimals
+    half_way = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if half_way.any():
+        rounded[half_way] = [round(coordinate, decimals)
+                             for coordinate in coordinates[half_way].tolist()]
+    return rounded
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
 def horizontal_surface_coordinates(coordinates_dictionary, origin):
     '''
     Function which adjust coordinates to be suitable for creating E+ horizontal
@@ -501,23 +952,22 @@ def polygon_with_holes(coordinates_dictionary):
         # Return coordinates of outer ring LineString with inner ring
         return coordinates
 
-    def dist_two_points(p1, p2):
+    def distance_matrix(outer_coordinates, inner_coordinates):
         '''
-        Internal function which calculates the Euclidean distance between two
-        points
+        Internal function which calculates the Euclidean distance between
+        each outer ring ordered pair (rows) and inner ring ordered pair
+        (columns)
         '''
-        distance = math.sqrt(math.pow(
-            (p1[0] - p2[0]), 2) + math.pow((p1[1] - p2[1]), 2))
-        # Return distance between two points
-        return distance
-
-    def inner_string(inner_ring_coordinates, irop):
+        outer = np.array(outer_coordinates, dtype=float).reshape(-1, 2)
+        inner = np.array(inner_coordinates, dtype=float).reshape(-1, 2)
+        dx = outer[:, np.newaxis, 0] - inner[np.newaxis, :, 0]
+        dy = outer[:, np.newaxis, 1] - inner[np.newaxis, :, 1]
+        # Return distances between the ordered pairs
+        return np.sqrt(dx * dx + dy * dy)
+
+    def inner_string(inner_ring_coordinates, split_position):
         inner_coordinates = list(inner_ring_coordinates)
 
-        for i, coord in enumerate(inner_coordinates):
-            if coord == irop:
-                split_position = i
-                break
         if split_position == 0:
             inner_linestring = LineString(inner_coordinates)
         else:
@@ -535,40 +985,24 @@ def polygon_with_holes(coordinates_dictionary):
     # Loop through the list of inner rings (holes)
     for inner_ring_coordinates in coordinates_dictionary['inner_rings']:
         # orop / irop: outer / inner ring ordered pair
-        # Loop through the coordinates of outer ring
-        for i, orop in enumerate(outer_ring_coordinates[0][:-1]):
-            # Loop through coordinates of inner ring
-            for j, irop in enumerate(inner_ring_coordinates[:-1]):
-                # Set an initial minimum distance between outer and inner rings
-                # for first ordered pairs of outer and inner rings
-                if i == 0 and j == 0:
-                    # outer ring - inner ring coordinates minimum distance
-                    oi_min_distance = dist_two_points(orop, irop)
-                    if oi_min_distance > 0.015:
-                        # outer ring - inner ring minimum distance LineString
-                        oi_min_linestring = LineString([orop, irop])
-                        # Get the difference between inner ring and
-                        # intersection point between inner ring and LineSting
-                        # connecting inner ring and outer ring. If intersection
-                        # point is not the first coordinate of inner ring than
-                        # inner ring will be broken to a MultiLineString
-                        inner_linestring = inner_string(inner_ring_coordinates,
-                                                        irop)
-
-                    else:
-                        oi_min_distance = 1e9
-                # Update the minimum distance between outer and inner rings,
-                # LineString connecting these outer and inner ring along the
-                # minimum distance and inner ring LineSting (MultiLineSting) by
-                # checking the distance between other inner and outer
-                # coordinates
-                else:
-                    distance = dist_two_points(orop, irop)
-                    if (distance < oi_min_distance) and (distance > 0.015):
-                        oi_min_distance = distance
-                        oi_min_linestring = LineString([orop, irop])
-                        inner_linestring = inner_string(inner_ring_coordinates,
-                                                        irop)
+        outer_ring_ops = outer_ring_coordinates[0][:-1]
+        inner_ring_ops = inner_ring_coordinates[:-1]
+        # Distances between all coordinates of outer and inner ring. Ordered
+        # pairs closer than 0.015 are not connected
+        distances = distance_matrix(outer_ring_ops, inner_ring_ops)
+        distances[distances <= 0.015] = np.inf
+        # Find the minimum distance between outer and inner rings (the first
+        # in outer then inner ring order when more than one pair has it)
+        if distances.size and np.isfinite(distances.min()):
+            i, j = np.unravel_index(np.argmin(distances), distances.shape)
+            orop, irop = outer_ring_ops[i], inner_ring_ops[j]
+            # outer ring - inner ring minimum distance LineString
+            oi_min_linestring = LineString([orop, irop])
+            # Get the difference between inner ring and intersection point
+            # between inner ring and LineSting connecting inner ring and outer
+            # ring. If intersection point is not the first coordinate of inner
+            # ring than inner ring will be broken to a MultiLineString
+            inner_linestring = inner_string(inner_ring_coordinates, j)
 
         # Append the dictionary with the key: ordered pair at outer ring /
         # value: list of inner rings LineSting or MultiLineString
@@ -630,8 +1064,9 @@ def adiabatic_roof(idf, polygon_name, horizontal_surface_coordinates,
         ceiling_height, horizontal_surface_coordinates)
     coordinates_list = idf_ceiling_coordinates_list(ceiling_coordinates_list)
     surface_name = polygon_name + '_AdiabaticRoof'
-    for coordinates in coordinates_list:
-        shading_building_detailed(idf, surface_name, coordinates)
+    idf.newidfobjects('Shading:Building:Detailed'.upper(),
+                      [shading_building_fields(surface_name, coordinates)
+                       for coordinates in coordinates_list])
     return
 
 # END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
@@ -639,19 +1074,18 @@ def adiabatic_roof(idf, polygon_name, horizontal_surface_coordinates,
 
 def coordinates_add_height(height, coordinates_list):
     '''
-    Function which adds Z coordinate to coordinate pairs
+    Function which adds Z coordinate to coordinate pairs. Each coordinates list
+    is returned as an array of coordinates (n, 3)
     '''
+    # Height rounded to 2 decimal spaces
+    height = round(height, 2)
     coordinates_with_height = []
-    # Loop through the coordinates in the list of coordinates
+    # Loop through the coordinates in the list of coordinates and append each
+    # ordered pair with height
     for coordinates in coordinates_list:
-        # Empty list for ordered pairs with height
-        ordered_pair_with_height = []
-        # Loop through coordinates and append each ordered pair with height
-        # rounded to 2 decimal spaces
-        for op in coordinates:
-            op_with_height = op + [round(height, 2)]
-            ordered_pair_with_height.append(op_with_height)
-        # Append coordinates with height list with ordered pair with height lst
+        ordered_pair_with_height = np.empty((len(coordinates), 3))
+        ordered_pair_with_height[:, :2] = coordinates
+        ordered_pair_with_height[:, 2] = height
         coordinates_with_height.append(ordered_pair_with_height)
     # Return ordered pair with height list
     return coordinates_with_height
@@ -668,10 +1102,9 @@ def idf_ceiling_coordinates_list(ceiling_coordinates_list):
     for ceiling_coordinates in ceiling_coordinates_list:
         # For each coordinates list remove the last element (which is same as
         # first since energyplus surfaces don't end in the first coordinate)
-        ceiling_coordinates = ceiling_coordinates[:-1]
-        # Reverse the list of coordinates in order to have energyplus surface
-        # facing outside
-        ceiling_coordinates = list(reversed(ceiling_coordinates))
+        # and reverse the list of coordinates in order to have energyplus
+        # surface facing outside
+        ceiling_coordinates = ceiling_coordinates[-2::-1].tolist()
         # Append a list of ceiling coordinates lists
         idf_ceiling_coordinates_list.append(ceiling_coordinates)
     # Return a list of ceiling coordinates lists
@@ -680,30 +1113,21 @@ def idf_ceiling_coordinates_list(ceiling_coordinates_list):
 # END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
-def shading_building_detailed(idf, surface_name, coordinates):
+def shading_building_fields(surface_name, coordinates):
     '''
-    Function which creates ShadingBuilding:Detailed energyplus object
+    Function which returns the fields of a ShadingBuilding:Detailed
+    energyplus object
     '''
-    idf.newidfobject(
-        'Shading:Building:Detailed'.upper(),
-        Name=surface_name)
-    # Add coordinates to the latest added energyplus object
-    objects = idf.idfobjects['Shading:Building:Detailed'.upper()][-1]
-    # Loop through coordinates list and assign X, Y, and Z vertex of each#
-    # ordered pair to the associated Vertex coordinate
-    for i, ordered_pair in enumerate(coordinates):
-        exec('objects.Vertex_{}_Xcoordinate = ordered_pair[0]'.format(i + 1))
-        exec('objects.Vertex_{}_Ycoordinate = ordered_pair[1]'.format(i + 1))
-        exec('objects.Vertex_{}_Zcoordinate = ordered_pair[2]'.format(i + 1))
-    return
+    fields = dict(Name=surface_name)
+    fields.update(vertex_fields(coordinates))
+    return fields
 
 # END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
 def adiabatic_external_walls(idf, polygon_name, perimeter_surface_coordinates,
                              ceiling_height, floor_height, wall_name,
-                             adjacent_polygons_list, df,
-                             polygon_shapely, origin):
+                             adjacent_polygons_list, party_wall_dict):
     '''
     Function which generates energyplus object for adiabatic external walls. It
     is composed of two parts (1) external walls which are not parts of adjacent
@@ -722,32 +1146,24 @@ def adiabatic_external_walls(idf, polygon_name, perimeter_surface_coordinates,
         is formed of two top and two bottom coordinates while in the horizontal
         coordinate list can be a lot of adjacent coordinates pairs
         '''
-        # Append the perimeter coordinates with the ceiling and floor heights
-        ceiling_coordinates = coordinates_add_height(
-            ceiling_height, perimeter_surface_coordinates)
-        floor_coordinates = coordinates_add_height(
-            floor_height, perimeter_surface_coordinates)
-        # Loop through list of ceiling coordinates lists to extract ceiling and
-        # floor coordinate lists. It can be more than one list pair in case of
-        # presence of inner holes
-        for n, item in enumerate(ceiling_coordinates):
-            ceil_coord = ceiling_coordinates[n]
-            floor_coord = floor_coordinates[n]
-            # Loop through ceiling coordinate list up to the next to the last
-            # item
-            for i, p in enumerate(ceil_coord[:-1]):
-                # Calculate wall centre coordinate in 3D plane (used for
-                # naming)
-                wcc = wall_centre_coordinate(
-                    ceil_coord[i + 1], ceil_coord[i], floor_coord[i])
-                # Generate the name form polygon name, wall name and centre
-                # coordinate
-                surface_name = polygon_name + '_' + wall_name + '_' + wcc
-                # Generate wall coordinates in format used by energyplus
-                coordinates = idf_wall_coordinates(i, ceil_coord, floor_coord)
-                # Creates shading elements which represent the adiabatic
-                # external wall
-                shading_building_detailed(idf, surface_name, coordinates)
+        # Wall coordinates in format used by energyplus for all adjacent
+        # coordinate pairs (there can be more than one coordinates list in
+        # case of presence of inner holes)
+        wall_coordinates = wall_vertices(perimeter_surface_coordinates,
+                                         ceiling_height, floor_height)
+        shading_surfaces = list()
+        # Wall centre coordinate in 3D plane (used for naming)
+        for wcc, coordinates in zip(wall_centre_coordinates(wall_coordinates),
+                                    wall_coordinates.tolist()):
+            # Generate the name form polygon name, wall name and centre
+            # coordinate
+            surface_name = polygon_name + '_' + wall_name + '_' + wcc
+            # Shading elements which represent the adiabatic external wall
+            shading_surfaces.append(
+                shading_building_fields(surface_name, coordinates))
+        # Creates the shading elements together
+        idf.newidfobjects('Shading:Building:Detailed'.upper(),
+                          shading_surfaces)
         return
 
     # Create adiabatic external walls for non-adjacent surfaces
@@ -757,21 +1173,10 @@ def adiabatic_external_walls(idf, polygon_name, perimeter_surface_coordinates,
     if adjacent_polygons_list:
         # Loop through the list of adjacent objects
         for polygon in adjacent_polygons_list:
-            # Slice the built block DataFrame to include only records for
+            # Party wall coordinates (relative to origin) and height of the
             # adjacent object
-            adjacent_polygon_df = df.loc[df['osgb'] == polygon]
-            # Extract polygon from the adjacent objects DataFrame
-            adjacent_polygon = adjacent_polygon_df['sa_polygon'].iloc[0]
-            # Convert polygon to shapley object
-            adjacent_polygon = loads(adjacent_polygon)
-
-            # Find the intersection between two polygons (it will be LineString
-            # or MultiLineString) and position coordinates relative to origin
-            part_wall_polygon = polygon_shapely.intersection(adjacent_polygon)
-            ajd_wall_parti_surf_coord = surface_coordinates(part_wall_polygon,
-                                                            origin)
-            # Extract the height of an adjacent object
-            adjacent_height = adjacent_polygon_df['height'].iloc[0]
+            ajd_wall_parti_surf_coord, adjacent_height = party_wall_dict[
+                (polygon_name, polygon)]
             # Check if the ceiling height is above the height of the adjacent
             # object. If not than there is no adiabatic external wall above the
             # adjacent object. If yes, than check the relation of floor height
@@ -791,52 +1196,96 @@ def adiabatic_external_walls(idf, polygon_name, perimeter_surface_coordinates,
 # END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
-def wall_centre_coordinate(ceil_1, ceil_0, floor_0):
+def wall_centre_coordinates(wall_coordinates):
     '''
-    Function which calculates centre point of the wall. Return the
-    string with centre coordinate (X,Y,Z). Useful for surface naming
+    Function which calculates centre point of the walls. Return the list of
+    strings with centre coordinate (X,Y,Z). Useful for surface naming
     particularly in partition walls due to required opposite surface wall name
     '''
-    # List of horizontal/vertical coordinates ordered pair strings
-    hor = [ceil_1, ceil_0]
-    ver = [ceil_0, floor_0]
-    # Exclude Z and X coordinate from horizontal and vertical coordinates resp
-    hor = [item[:-1] for item in hor]
-    ver = [item[1:] for item in ver]
-    # By using shapley obtain the centre coordinate between ordered pairs
-    hor = LineString(hor).centroid
-    hor = hor.coords[0]
-    ver = LineString(ver).centroid
-    ver = ver.coords[0]
+    # Upper left, bottom right and upper right corner of the walls
+    ceil_1 = wall_coordinates[:, 0]
+    floor_0 = wall_coordinates[:, 2]
+    ceil_0 = wall_coordinates[:, 3]
+    # Centre of the horizontal edge (X and Y) and of the vertical edge (Y and
+    # Z) of the walls
+    hor = line_centres(ceil_1[:, :-1], ceil_0[:, :-1])
+    ver = line_centres(ceil_0[:, 1:], floor_0[:, 1:])
     # Wall centre coordinate is created from horizontal ordered pair appended
-    # with Z coordinate (ver[-1]) from vertical ordered pair
-    wcc = hor + (ver[-1],)
-    # Format wall centre coordinate as a string
-    wcc = ['%.2f' % item for item in wcc]
-    wcc = '(' + '_'.join(wcc) + ')'
-    # Return wall centre coordinate string
-    return wcc
+    # with Z coordinate from vertical ordered pair
+    wcc = np.column_stack((hor, ver[:, -1]))
+    # Format wall centre coordinates as strings
+    return ['({:.2f}_{:.2f}_{:.2f})'.format(*item) for item in wcc.tolist()]
 
 # END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
-def idf_wall_coordinates(i, ceiling_coordinates, floor_coordinates):
+def line_centres(start, end):
     '''
-    Function which converts wall coordinates into format used by E+
-    (upper left, bottom left, bottom right, upper right)
+    Function which calculates the centre points of the lines between the
+    ordered pairs of 'start' and 'end' as shapley calculates the centroid of
+    a line: the mid point weighted by the length of the line (or the mid
+    point if the length is zero)
     '''
-    idf_wall_coordinates = [ceiling_coordinates[i + 1],
-                            floor_coordinates[i + 1],
-                            floor_coordinates[i],
-                            ceiling_coordinates[i]]
+    difference = start - end
+    length = np.sqrt(difference[:, 0] * difference[:, 0] +
+                     difference[:, 1] * difference[:, 1])[:, np.newaxis]
+    mid = (start + end) / 2
+    centre = length * mid / np.where(length > 0, length, 1)
+    return np.where(length > 0, centre, mid)
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def wall_vertices(vertical_surface_coordinates, ceiling_height,
+                  floor_height):
+    '''
+    Function which creates the coordinates of the walls between adjacent
+    coordinate pairs of the vertical surface coordinates lists in format used
+    by E+ (upper left, bottom left, bottom right, upper right). Returns an
+    array of shape (number of walls, 4, 3)
+    '''
+    # Each adjacent coordinate pair of the coordinates lists forms a wall
+    coordinates_list = [coordinates for coordinates in
+                        vertical_surface_coordinates if len(coordinates) > 1]
+    if not coordinates_list:
+        return np.empty((0, 4, 3))
+    start = np.concatenate([coordinates[:-1]
+                            for coordinates in coordinates_list])
+    end = np.concatenate([coordinates[1:] for coordinates in coordinates_list])
+    walls = np.empty((len(start), 4, 3))
+    # Ordered pairs of the upper/bottom left and bottom/upper right corners
+    walls[:, :2, :2] = end[:, np.newaxis]
+    walls[:, 2:, :2] = start[:, np.newaxis]
+    # Ceiling and floor height rounded to 2 decimal spaces
+    walls[:, [0, 3], 2] = round(ceiling_height, 2)
+    walls[:, [1, 2], 2] = round(floor_height, 2)
     # Return wall coordinates
-    return idf_wall_coordinates
+    return walls
 
 # END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
-def thermal_zones(row, df, idf, origin, zone_use_dict):
-    polygon = loads(row.sa_polygon)
+def wall_width_height(wall_coordinates):
+    '''
+    Function which calculates the widths and heights of the walls
+    '''
+    # Upper left, bottom left and bottom right corner coordinates
+    ulc = wall_coordinates[:, 0]
+    blc = wall_coordinates[:, 1]
+    brc = wall_coordinates[:, 2]
+    # Calculate wall width and height by using the Euclidean distance
+    w = brc - blc
+    h = ulc - blc
+    w = np.sqrt(w[:, 0] * w[:, 0] + w[:, 1] * w[:, 1] + w[:, 2] * w[:, 2])
+    h = np.sqrt(h[:, 0] * h[:, 0] + h[:, 1] * h[:, 1] + h[:, 2] * h[:, 2])
+    # Return wall width and height
+    return w, h
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def thermal_zones(row, party_wall_dict, idf, origin, zone_use_dict,
+                  zone_multipliers=False):
     # Polygon with removed collinear point to be used for ceiling/floor/roof
     hor_polygon = row.sa_polygon_horizontal
     # Convert polygon coordinates to dictionary of outer and inner (if any)
@@ -845,12 +1294,12 @@ def thermal_zones(row, df, idf, origin, zone_use_dict):
     # List of horizontal surfaces coordinates (roof/floor/ceiling)
     horiz_surf_coord = horizontal_surface_coordinates(
         hor_poly_coord_dict, origin)
-    # Load the polygon which defines only external surfaces
-    ext_surf_polygon = loads(row.sa_polygon_exposed_wall)
+    # Polygon which defines only external surfaces
+    ext_surf_polygon = row.sa_polygon_exposed_wall
     # List of external surface only coordinates (ext_surf_polygon + in. rings)
     ext_surf_coord = surface_coordinates(ext_surf_polygon, origin)
     # List of adjacent polygons
-    adj_osgb_list = literal_eval(row.sa_collinear_touching)
+    adj_osgb_list = row.sa_collinear_touching
 
 
     # Retrieve required attributes from table
@@ -973,17 +1422,10 @@ def thermal_zones(row, df, idf, origin, zone_use_dict):
             # Loop through the list of adjacent objects
             for adj_osgb in adj_osgb_list:
                 opposite_zone = adj_osgb
-                # Extract polygon from the adjacent objects DataFrame
-                adj_polygon = loads(df.loc[df['osgb'] == adj_osgb,
-                                           'sa_polygon'].values[0])
-                adj_height = df.loc[df['osgb'] == adj_osgb,
-                                    'height'].values[0]
-                # Find the intersection between two polygons (it will be
-                # LineString or MultiLineString) and position coordinates
-                # relative to origin
-                part_wall_polygon = polygon.intersection(adj_polygon)
-                adj_wall_parti_surf_coord = surface_coordinates(
-                    part_wall_polygon, origin)
+                # Party wall coordinates (relative to origin) and height
+                # of the adjacent object
+                adj_wall_parti_surf_coord, adj_height = party_wall_dict[
+                    (row.osgb, adj_osgb)]
                 if zone_ceiling_h < adj_height + 1e-6:
                     partition_walls(idf, zone_name, opposite_zone,
                                     adj_wall_parti_surf_coord,
@@ -1013,8 +1455,17 @@ def thermal_zones(row, df, idf, origin, zone_use_dict):
 
     else:
         f2f = round(height / row.nofloors, 1)
+        # Zone multiplier of each floor (all 1 unless intermediate floors are
+        # grouped)
+        if zone_multipliers:
+            multipliers = floor_multipliers(row, party_wall_dict, f2f)
+        else:
+            multipliers = dict.fromkeys(range(1, len(floors) + 1), 1)
         for item in floors:
             floor_no = item + 1
+            # Floor represented by the zone of the floor below
+            if multipliers[floor_no] == 0:
+                continue
             if item == 0:
                 zone_name = '{}_floor_{}'.format(row.osgb, floor_no)
                 try:
@@ -1027,7 +1478,12 @@ def thermal_zones(row, df, idf, origin, zone_use_dict):
                 space_above_floor = '{}_floor_{}'.format(
                     row.osgb, (floor_no + 1))
 
-                idf.newidfobject('ZONE', Name=zone_name)
+                # Zone multiplier and floor/ceiling boundaries of grouped
+                # floors
+                multiplier, space_below_floor, space_above_floor = (
+                    zone_multiplier(multipliers, floor_no, space_below_floor,
+                                    space_above_floor))
+                idf.newidfobject('ZONE', Name=zone_name, Multiplier=multiplier)
 
                 floor_const = ground_floor_const
                 floor(idf, zone_name, space_below_floor,
@@ -1050,17 +1506,10 @@ def thermal_zones(row, df, idf, origin, zone_use_dict):
                     # Loop through the list of adjacent objects
                     for adj_osgb in adj_osgb_list:
                         opposite_zone = adj_osgb
-                        # Extract polygon from the adjacent objects DataFrame
-                        adj_polygon = loads(df.loc[df['osgb'] == adj_osgb,
-                                                   'sa_polygon'].values[0])
-                        adj_height = df.loc[df['osgb'] == adj_osgb,
-                                            'height'].values[0]
-                        # Find the intersection between two polygons (it will
-                        # be LineString or MultiLineString) and position
-                        # coordinates relative to origin
-                        part_wall_polygon = polygon.intersection(adj_polygon)
-                        adj_wall_parti_surf_coord = surface_coordinates(
-                            part_wall_polygon, origin)
+                        # Party wall coordinates (relative to origin) and height
+                        # of the adjacent object
+                        adj_wall_parti_surf_coord, adj_height = party_wall_dict[
+                            (row.osgb, adj_osgb)]
                         if zone_ceiling_h < adj_height + 1e-6:
                             partition_walls(idf, zone_name, opposite_zone,
                                             adj_wall_parti_surf_coord,
@@ -1100,7 +1549,12 @@ def thermal_zones(row, df, idf, origin, zone_use_dict):
                 zone_ceiling_h = height
                 space_above_floor = 'Outdoors'
 
-                idf.newidfobject('ZONE', Name=zone_name)
+                # Zone multiplier and floor/ceiling boundaries of grouped
+                # floors
+                multiplier, space_below_floor, space_above_floor = (
+                    zone_multiplier(multipliers, floor_no, space_below_floor,
+                                    space_above_floor))
+                idf.newidfobject('ZONE', Name=zone_name, Multiplier=multiplier)
 
                 floor_const = "ceiling_inverse"
                 floor(idf, zone_name, space_below_floor,
@@ -1123,17 +1577,10 @@ def thermal_zones(row, df, idf, origin, zone_use_dict):
                     # Loop through the list of adjacent objects
                     for adj_osgb in adj_osgb_list:
                         opposite_zone = adj_osgb
-                        # Extract polygon from the adjacent objects DataFrame
-                        adj_polygon = loads(df.loc[df['osgb'] == adj_osgb,
-                                                   'sa_polygon'].values[0])
-                        adj_height = df.loc[df['osgb'] == adj_osgb,
-                                            'height'].values[0]
-                        # Find the intersection between two polygons (it will
-                        # be LineString or MultiLineString) and position
-                        # coordinates relative to origin
-                        part_wall_polygon = polygon.intersection(adj_polygon)
-                        adj_wall_parti_surf_coord = surface_coordinates(
-                            part_wall_polygon, origin)
+                        # Party wall coordinates (relative to origin) and height
+                        # of the adjacent object
+                        adj_wall_parti_surf_coord, adj_height = party_wall_dict[
+                            (row.osgb, adj_osgb)]
                         if zone_ceiling_h < adj_height + 1e-6:
                             partition_walls(idf, zone_name, opposite_zone,
                                             adj_wall_parti_surf_coord,
@@ -1174,7 +1621,12 @@ def thermal_zones(row, df, idf, origin, zone_use_dict):
                 space_above_floor = '{}_floor_{}'.format(
                     row.osgb, (floor_no + 1))
 
-                idf.newidfobject('ZONE', Name=zone_name)
+                # Zone multiplier and floor/ceiling boundaries of grouped
+                # floors
+                multiplier, space_below_floor, space_above_floor = (
+                    zone_multiplier(multipliers, floor_no, space_below_floor,
+                                    space_above_floor))
+                idf.newidfobject('ZONE', Name=zone_name, Multiplier=multiplier)
 
                 floor_const = "ceiling_inverse"
                 floor(idf, zone_name, space_below_floor,
@@ -1198,17 +1650,10 @@ def thermal_zones(row, df, idf, origin, zone_use_dict):
                     # Loop through the list of adjacent objects
                     for adj_osgb in adj_osgb_list:
                         opposite_zone = adj_osgb
-                        # Extract polygon from the adjacent objects DataFrame
-                        adj_polygon = loads(df.loc[df['osgb'] == adj_osgb,
-                                                   'sa_polygon'].values[0])
-                        adj_height = df.loc[df['osgb'] == adj_osgb,
-                                            'height'].values[0]
-                        # Find the intersection between two polygons (it will
-                        # be LineString or MultiLineString) and position
-                        # coordinates relative to origin
-                        part_wall_polygon = polygon.intersection(adj_polygon)
-                        adj_wall_parti_surf_coord = surface_coordinates(
-                            part_wall_polygon, origin)
+                        # Party wall coordinates (relative to origin) and height
+                        # of the adjacent object
+                        adj_wall_parti_surf_coord, adj_height = party_wall_dict[
+                            (row.osgb, adj_osgb)]
                         if zone_ceiling_h < adj_height + 1e-6:
                             partition_walls(idf, zone_name, opposite_zone,
                                             adj_wall_parti_surf_coord,
@@ -1241,6 +1686,69 @@ def thermal_zones(row, df, idf, origin, zone_use_dict):
 # END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
+def floor_multipliers(row, party_wall_dict, f2f):
+    '''
+    Function which groups consecutive intermediate floors (neither ground nor
+    top floor) with the same use and the same partition and external walls.
+    Each group is modelled as the zone of its lowest floor with an E+ zone
+    multiplier. Returns a dictionary of floor number: zone multiplier, which
+    is 0 for the floors represented by the zone of a floor below
+    '''
+    nofloors = int(row.nofloors)
+    multipliers = dict.fromkeys(range(1, nofloors + 1), 1)
+    # Heights of the adjacent objects
+    adj_heights = [party_wall_dict[(row.osgb, adj_osgb)][1]
+                   for adj_osgb in row.sa_collinear_touching]
+    group_floor, group_key = None, None
+    for floor_no in range(2, nofloors):
+        zone_floor_h = (floor_no - 1) * f2f
+        zone_ceiling_h = floor_no * f2f
+        try:
+            use = row["FLOOR_{}: use".format(floor_no)]
+        except KeyError:
+            use = "Dwell"
+        # Walls towards each adjacent object are either partition or external
+        # walls. Floors with walls which are partly both are not grouped
+        walls = list()
+        for adj_height in adj_heights:
+            if zone_ceiling_h < adj_height + 1e-6:
+                walls.append('partition')
+            elif zone_floor_h > adj_height - 1e-6:
+                walls.append('external')
+            else:
+                walls = None
+                break
+        key = None if walls is None else (use, tuple(walls))
+        if key is not None and key == group_key:
+            multipliers[group_floor] += 1
+            multipliers[floor_no] = 0
+        else:
+            group_floor, group_key = floor_no, key
+    return multipliers
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def zone_multiplier(multipliers, floor_no, space_below_floor,
+                    space_above_floor):
+    '''
+    Function which returns the zone multiplier of a floor and the spaces below
+    and above it. Floors and ceilings of a zone with a zone multiplier and of
+    the zones below and above it are adiabatic
+    '''
+    multiplier = multipliers[floor_no]
+    # Floor below is grouped or this floor is grouped
+    if multiplier > 1 or multipliers.get(floor_no - 1, 1) != 1:
+        space_below_floor = 'Adiabatic'
+    # Floor above is grouped (its zone multiplier is 0 if it is represented
+    # by this floor) or this floor is grouped
+    if multiplier > 1 or multipliers.get(floor_no + 1, 1) != 1:
+        space_above_floor = 'Adiabatic'
+    return multiplier, space_below_floor, space_above_floor
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
 def floor(idf, zone_name, space_below_floor, horizontal_surface_coordinates,
           floor_height, ground_floor_const):
     '''
@@ -1258,7 +1766,7 @@ def floor(idf, zone_name, space_below_floor, horizontal_surface_coordinates,
             # For each coordinates list remove the last element (which is same
             # as first since energyplus surfaces don't end in the first
             # coordinate)
-            idf_floor_coordinates = floor_coordinates[:-1]
+            idf_floor_coordinates = floor_coordinates[:-1].tolist()
             # Append a list of floor coordinates lists
             idf_floor_coordinates_list.append(idf_floor_coordinates)
         # Return a list of floor coordinates lists
@@ -1276,6 +1784,11 @@ def floor(idf, zone_name, space_below_floor, horizontal_surface_coordinates,
     if space_below_floor == 'Ground':
         outside_boundary_condition = space_below_floor
         outside_boundary_condition_object = ''
+    # If the floor is between a zone with a zone multiplier and the zone below
+    # than set up outside boundary condition to the 'Adiabatic'
+    elif space_below_floor == 'Adiabatic':
+        outside_boundary_condition = space_below_floor
+        outside_boundary_condition_object = ''
     # If space below the floor is thermal zone than set up outside boundary
     # condition to the 'Surface', outside boundary condition object to the zone
     # below name appended with '_Ceiling' string
@@ -1289,27 +1802,27 @@ def floor(idf, zone_name, space_below_floor, horizontal_surface_coordinates,
     coordinates_list = idf_floor_coordinates_list(floor_coordinates_list)
     # For each coordinates list in a list of coordinates lists creates building
     # surface detailed element which represents the floor
-    for coordinates in coordinates_list:
-        building_surface_detailed(idf, surface_name, surface_type,
-                                  ground_floor_const, zone_name,
-                                  outside_boundary_condition,
-                                  outside_boundary_condition_object,
-                                  sun_exposure, wind_exposure, coordinates)
+    idf.newidfobjects('BuildingSurface:Detailed'.upper(), [
+        building_surface_fields(surface_name, surface_type,
+                                ground_floor_const, zone_name,
+                                outside_boundary_condition,
+                                outside_boundary_condition_object,
+                                sun_exposure, wind_exposure, coordinates)
+        for coordinates in coordinates_list])
     return
 
 # END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
-def building_surface_detailed(idf, surface_name, surface_type,
-                              construction_name, zone_name,
-                              outside_boundary_condition,
-                              outside_boundary_condition_object,
-                              sun_exposure, wind_exposure, coordinates):
+def building_surface_fields(surface_name, surface_type, construction_name,
+                            zone_name, outside_boundary_condition,
+                            outside_boundary_condition_object,
+                            sun_exposure, wind_exposure, coordinates):
     '''
-    Function which creates BuildingSurface:Detailed energyplus object
+    Function which returns the fields of a BuildingSurface:Detailed
+    energyplus object
     '''
-    idf.newidfobject(
-        'BuildingSurface:Detailed'.upper(),
+    fields = dict(
         Name=surface_name,
         Surface_Type=surface_type,
         Construction_Name=construction_name,
@@ -1318,15 +1831,24 @@ def building_surface_detailed(idf, surface_name, surface_type,
         Outside_Boundary_Condition_Object=outside_boundary_condition_object,
         Sun_Exposure=sun_exposure,
         Wind_Exposure=wind_exposure)
-    # Add coordinates to the latest added energyplus object
-    objects = idf.idfobjects['BuildingSurface:Detailed'.upper()][-1]
-    # Loop through coordinates list and assign X, Y, and Z vertex of each
-    # ordered pair to the associated Vertex coordinate
+    fields.update(vertex_fields(coordinates))
+    return fields
+
+# END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def vertex_fields(coordinates):
+    '''
+    Function which returns the Vertex coordinate fields of an energyplus
+    surface object: the X, Y, and Z vertex of each ordered pair in the
+    coordinates list
+    '''
+    fields = dict()
     for i, ordered_pair in enumerate(coordinates):
-        exec('objects.Vertex_%s_Xcoordinate = ordered_pair[0]' % (i + 1))
-        exec('objects.Vertex_%s_Ycoordinate = ordered_pair[1]' % (i + 1))
-        exec('objects.Vertex_%s_Zcoordinate = ordered_pair[2]' % (i + 1))
-    return
+        fields['Vertex_{}_Xcoordinate'.format(i + 1)] = ordered_pair[0]
+        fields['Vertex_{}_Ycoordinate'.format(i + 1)] = ordered_pair[1]
+        fields['Vertex_{}_Zcoordinate'.format(i + 1)] = ordered_pair[2]
+    return fields
 
 # END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
@@ -1356,9 +1878,15 @@ def roof_ceiling(idf, zone_name, space_above_floor,
         wind_exposure = 'NoWind'
         # Set up outside boundary condition to the 'Surface' and outside
         # boundary condition object to the zone above name appended with
-        # '_Floor' string
-        outside_boundary_condition = 'Surface'
-        outside_boundary_condition_object = space_above_floor + '_Floor'
+        # '_Floor' string. If the ceiling is between a zone with a zone
+        # multiplier and the zone above than set up outside boundary
+        # condition to the 'Adiabatic'
+        if space_above_floor == 'Adiabatic':
+            outside_boundary_condition = space_above_floor
+            outside_boundary_condition_object = ''
+        else:
+            outside_boundary_condition = 'Surface'
+            outside_boundary_condition_object = space_above_floor + '_Floor'
     # Append the roof/ceiling horizontal coordinates with the height
     ceiling_coordinates_list = coordinates_add_height(
         ceiling_height, horizontal_surface_coordinates)
@@ -1366,12 +1894,13 @@ def roof_ceiling(idf, zone_name, space_above_floor,
     coordinates_list = idf_ceiling_coordinates_list(ceiling_coordinates_list)
     # For each coordinates list in a list of coordinates lists creates building
     # surface detailed element which represents the roof/ceiling
-    for coordinates in coordinates_list:
-        building_surface_detailed(idf, surface_name, surface_type,
-                                  roof_const, zone_name,
-                                  outside_boundary_condition,
-                                  outside_boundary_condition_object,
-                                  sun_exposure, wind_exposure, coordinates)
+    idf.newidfobjects('BuildingSurface:Detailed'.upper(), [
+        building_surface_fields(surface_name, surface_type,
+                                roof_const, zone_name,
+                                outside_boundary_condition,
+                                outside_boundary_condition_object,
+                                sun_exposure, wind_exposure, coordinates)
+        for coordinates in coordinates_list])
     return
 
 # END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
@@ -1388,33 +1917,12 @@ def external_walls(idf, zone_name, floor_number,
     Added overhang depth for the Simstock QGIS plugin
     '''
 
-    def wall_width_height(i, ceil_coord, floor_coord):
-        '''
-        Internal function which calculates wall width and height
-        '''
-        # upper left corner coordinates
-        ulc = ceil_coord[i + 1]
-        # bottom left corner coordinates
-        blc = floor_coord[i + 1]
-        # bottom right corner coordinates
-        brc = floor_coord[i]
-        # Calculate wall width and height by using the Euclidean distance
-        w = math.sqrt(math.pow(
-            (brc[0] - blc[0]), 2) + math.pow((brc[1] - blc[1]), 2) +
-            math.pow((brc[2] - blc[2]), 2))
-        h = math.sqrt(math.pow(
-            (ulc[0] - blc[0]), 2) + math.pow((ulc[1] - blc[1]), 2) +
-            math.pow((ulc[2] - blc[2]), 2))
-        # Return wall width and height
-        return w, h
-
-    def window(idf, surface_name, construction_name, building_surface_name,
+    def window(surface_name, construction_name, building_surface_name,
                starting_x_coordinate, starting_z_coordinate, length, height):
         '''
-        Function which creates Window energyplus object
+        Function which returns the fields of a Window energyplus object
         '''
-        idf.newidfobject(
-            'Window'.upper(),
+        return dict(
             Name=surface_name,
             Construction_Name=construction_name,
             Building_Surface_Name=building_surface_name,
@@ -1422,23 +1930,22 @@ def external_walls(idf, zone_name, floor_number,
             Starting_Z_Coordinate=starting_z_coordinate,
             Length=length,
             Height=height)
-        return
     
     ############################################################################
-    def overhang(idf, window_name, depth):
-        """Adds a shading overhang to window with the specified depth. 
+    def overhang(window_name, depth):
+        """Returns the fields of a shading overhang to window with the
+        specified depth (None if there is no overhang). 
         Used in the Simstock QGIS plugin."""
         if isinstance(depth, float) or isinstance(depth, int):
             if depth > 0:
-                idf.newidfobject('SHADING:OVERHANG',
-                                Name=window_name+"_Overhang",
-                                Window_or_Door_Name=window_name,
-                                Height_above_Window_or_Door=0.0,
-                                Tilt_Angle_from_WindowDoor=90.0,
-                                Left_extension_from_WindowDoor_Width=0.0,
-                                Right_extension_from_WindowDoor_Width=0.0,
-                                Depth=depth)
-        return
+                return dict(Name=window_name+"_Overhang",
+                            Window_or_Door_Name=window_name,
+                            Height_above_Window_or_Door=0.0,
+                            Tilt_Angle_from_WindowDoor=90.0,
+                            Left_extension_from_WindowDoor_Width=0.0,
+                            Right_extension_from_WindowDoor_Width=0.0,
+                            Depth=depth)
+        return None
     ############################################################################
 
     # surface type
@@ -1447,65 +1954,63 @@ def external_walls(idf, zone_name, floor_number,
     sun_exposure = 'SunExposed'
     wind_exposure = 'WindExposed'
     outside_boundary_condition = 'Outdoors'
-    # Append the vertical surface coordinates with the ceiling and floor height
-    ceiling_coordinates = coordinates_add_height(ceiling_height,
-                                                 vertical_surface_coordinates)
-    floor_coordinates = coordinates_add_height(floor_height,
-                                               vertical_surface_coordinates)
-    # Loop through the list of ceiling coordinates lists
-    for n, _ in enumerate(ceiling_coordinates):
-        # Floor and ceiling coordinates lists
-        ceil_coord = ceiling_coordinates[n]
-        floor_coord = floor_coordinates[n]
-        # Loop through ceiling coordinate list up to the next to the last item
-        for i, _ in enumerate(ceil_coord[:-1]):
-            # Calculate wall centre coordinate in 3D plane (used for naming)
-            wcc = wall_centre_coordinate(
-                ceil_coord[i + 1], ceil_coord[i], floor_coord[i])
-            # Generate the surface name form zone name, '_Wall_' string and
-            # centre coordinate
-            surface_name = zone_name + '_Wall_' + wcc
-            # Generate wall coordinates in format used by energyplus
-            coordinates = idf_wall_coordinates(i, ceil_coord, floor_coord)
-            # Creates building surface detailed element which represent wall
-            building_surface_detailed(idf, surface_name, surface_type,
-                                      wall_const, zone_name,
-                                      outside_boundary_condition,
-                                      outside_boundary_condition_object,
-                                      sun_exposure, wind_exposure, coordinates)
-            # Calculates wall width and height
-            w, h = wall_width_height(i, ceil_coord, floor_coord)
-            # When wall width and height is above limitation (subtract by 1mm
-            # due to floating point precision) add the window object as a
-            # function of glazing ratio
-            if (w >= min_window_width) and (
-                    h >= (min_avail_height * zone_height / 100) - 0.001):
-                # window length and height
-                wl = w * math.sqrt(glazing_ratio / 100)
-                wh = h * math.sqrt(glazing_ratio / 100)
-                # Starting X and Z coordinates relative to the wall bottom
-                # left corner
-                x = (w - wl) / 2
-                z = (h - wh) / 2
-                # Window name made from the surface name appended with
-                # the '_Window' string
-                win_surface_name = surface_name + '_Window'
-                # Base surface name
-                building_surface_name = surface_name
-                # Coordinates converted into strings
-                starting_x_coordinate = '%.2f' % x
-                starting_z_coordinate = '%.2f' % z
-                win_length = '%.2f' % wl
-                win_height = '%.2f' % wh
-                # Add the window energyplus object
-                window(idf, win_surface_name, glazing_const,
-                       building_surface_name, starting_x_coordinate,
-                       starting_z_coordinate, win_length, win_height)
-
-                ################################################################
-                # Plugin: add overhang to each window of custom depth
-                overhang(idf, win_surface_name, overhang_depth)
-                ################################################################
+    # Wall coordinates in format used by energyplus, wall centre coordinates
+    # in 3D plane (used for naming) and wall widths and heights
+    wall_coordinates = wall_vertices(vertical_surface_coordinates,
+                                     ceiling_height, floor_height)
+    wccs = wall_centre_coordinates(wall_coordinates)
+    widths, heights = wall_width_height(wall_coordinates)
+    # Windows are added to the walls whose width and height is above
+    # limitation (subtract by 1mm due to floating point precision) as a
+    # function of glazing ratio
+    with_window = (widths >= min_window_width) & (
+        heights >= (min_avail_height * zone_height / 100) - 0.001)
+    # Window length and height
+    wls = widths * math.sqrt(glazing_ratio / 100)
+    whs = heights * math.sqrt(glazing_ratio / 100)
+    # Starting X and Z coordinates relative to the wall bottom left corner
+    xs = (widths - wls) / 2
+    zs = (heights - whs) / 2
+    walls, windows, overhangs = list(), list(), list()
+    for wcc, coordinates, window_added, x, z, wl, wh in zip(
+            wccs, wall_coordinates.tolist(), with_window.tolist(),
+            xs.tolist(), zs.tolist(), wls.tolist(), whs.tolist()):
+        # Generate the surface name form zone name, '_Wall_' string and
+        # centre coordinate
+        surface_name = zone_name + '_Wall_' + wcc
+        # Building surface detailed element which represent wall
+        walls.append(building_surface_fields(
+            surface_name, surface_type, wall_const, zone_name,
+            outside_boundary_condition, outside_boundary_condition_object,
+            sun_exposure, wind_exposure, coordinates))
+        if window_added:
+            # Window name made from the surface name appended with the
+            # '_Window' string
+            win_surface_name = surface_name + '_Window'
+            # Base surface name
+            building_surface_name = surface_name
+            # Coordinates converted into strings
+            starting_x_coordinate = '%.2f' % x
+            starting_z_coordinate = '%.2f' % z
+            win_length = '%.2f' % wl
+            win_height = '%.2f' % wh
+            # Add the window energyplus object
+            windows.append(window(win_surface_name, glazing_const,
+                                  building_surface_name,
+                                  starting_x_coordinate,
+                                  starting_z_coordinate, win_length,
+                                  win_height))
+
+            ####################################################################
+            # Plugin: add overhang to each window of custom depth
+            window_overhang = overhang(win_surface_name, overhang_depth)
+            if window_overhang is not None:
+                overhangs.append(window_overhang)
+            ####################################################################
+    # Creates the walls, windows and overhangs together
+    idf.newidfobjects('BuildingSurface:Detailed'.upper(), walls)
+    idf.newidfobjects('Window'.upper(), windows)
+    idf.newidfobjects('SHADING:OVERHANG', overhangs)
     return
 
 # END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
@@ -1530,31 +2035,23 @@ def partition_walls(idf, zone_name, adj_osgb, vertical_surface_coordinates,
         outside_boundary_condition = 'Surface'
         obco = opposite_zone + '_Part_' + zone_name + '_' + wcc
 
-    # Append the vertical surface coordinates with the ceiling and floor height
-    ceiling_coordinates = coordinates_add_height(ceiling_height,
-                                                 vertical_surface_coordinates)
-    floor_coordinates = coordinates_add_height(floor_height,
-                                               vertical_surface_coordinates)
-    # Loop through the list of ceiling coordinates lists
-    for n, item in enumerate(ceiling_coordinates):
-        # Floor and ceiling coordinates lists
-        ceil_coord = ceiling_coordinates[n]
-        floor_coord = floor_coordinates[n]
-        # Loop through ceiling coordinate list up to the next to the last item
-        for i, p in enumerate(ceil_coord[:-1]):
-            # Calculate wall centre coordinate in 3D plane (used for naming)
-            wcc = wall_centre_coordinate(
-                ceil_coord[i + 1], ceil_coord[i], floor_coord[i])
-            # Generate the surface name form zone name, '_Part_' string,
-            # opposite zone name and centre coordinate
-            surface_name = zone_name + '_Part_' + opposite_zone + '_' + wcc
-            # Generate wall coordinates in format used by energyplus
-            coordinates = idf_wall_coordinates(i, ceil_coord, floor_coord)
-            # Creates partition building surface detailed element
-            building_surface_detailed(idf, surface_name, surface_type,
-                                      partition_const, zone_name,
-                                      outside_boundary_condition, obco,
-                                      sun_exposure, wind_exposure, coordinates)
+    # Wall coordinates in format used by energyplus
+    wall_coordinates = wall_vertices(vertical_surface_coordinates,
+                                     ceiling_height, floor_height)
+    walls = list()
+    # Wall centre coordinate in 3D plane (used for naming)
+    for wcc, coordinates in zip(wall_centre_coordinates(wall_coordinates),
+                                wall_coordinates.tolist()):
+        # Generate the surface name form zone name, '_Part_' string,
+        # opposite zone name and centre coordinate
+        surface_name = zone_name + '_Part_' + opposite_zone + '_' + wcc
+        # Partition building surface detailed element
+        walls.append(building_surface_fields(
+            surface_name, surface_type, partition_const, zone_name,
+            outside_boundary_condition, obco, sun_exposure,
+            wind_exposure, coordinates))
+    # Creates the partition walls together
+    idf.newidfobjects('BuildingSurface:Detailed'.upper(), walls)
     return
 
 # END OF FUNCTION  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
@@ -0,0 +1,79 @@
+"""
+/***************************************************************************
+ SimstockQGIS
+        copyright            : (C) 2023-2026 by UCL
+        email                : shyam.amrith.14@ucl.ac.uk
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+Tests of finding the E+ executables, whose paths have no extension on
+Windows. Run from the plugin directory with: python -m pytest tests
+"""
+
+import os
+import sys
+import importlib
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import simstockprocess
+
+
+@pytest.fixture
+def mptest(monkeypatch):
+    # mptest parses its command line when imported
+    monkeypatch.setattr(sys, 'argv', ['mptest.py', '.'])
+    return importlib.import_module('mptest')
+
+
+def make_file(path, text='exe'):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(text)
+    return path
+
+
+def test_resolve_executable_adds_exe_on_windows(tmp_path, monkeypatch):
+    monkeypatch.setattr(simstockprocess, 'WINDOWS', True)
+    exe = make_file(str(tmp_path / 'energyplus.exe'))
+    assert simstockprocess.resolve_executable(str(tmp_path / 'energyplus')) == exe
+    assert simstockprocess.resolve_executable(exe) == exe
+
+
+def test_resolve_executable_missing(tmp_path, monkeypatch):
+    monkeypatch.setattr(simstockprocess, 'WINDOWS', True)
+    assert simstockprocess.resolve_executable(str(tmp_path / 'energyplus')) is None
+    monkeypatch.setattr(simstockprocess, 'WINDOWS', False)
+    make_file(str(tmp_path / 'energyplus.exe'))
+    assert simstockprocess.resolve_executable(str(tmp_path / 'energyplus')) is None
+
+
+def test_settings_key_of_windows_executables(tmp_path, monkeypatch, mptest):
+    monkeypatch.setattr(simstockprocess, 'WINDOWS', True)
+    monkeypatch.setattr(mptest.platform, 'system', lambda: 'Windows')
+    ep_dir = str(tmp_path / 'EnergyPlus')
+    exe = make_file(os.path.join(ep_dir, 'ep8.9_windows', 'energyplus.exe'))
+    readvarseso = make_file(os.path.join(ep_dir, 'ep8.9_windows', 'ReadVarsESO.exe'))
+    assert mptest.energyplus_executables(ep_dir) == (exe, readvarseso)
+
+    epw = make_file(str(tmp_path / 'weather.epw'), 'weather')
+    cached = mptest.EPSettings(str(tmp_path), epw, exe, readvarseso,
+                               str(tmp_path / 'ep_cache'), None)
+    key = mptest.simulation_settings_key(cached)
+    # A new E+ executable invalidates the cached results
+    make_file(exe, 'new exe')
+    assert mptest.simulation_settings_key(cached) != key
+
+    # Without the cache the executable is not needed
+    uncached = cached._replace(energyplusexe=os.path.join(ep_dir, 'missing'),
+                               cache_dir=None)
+    assert mptest.simulation_settings_key(uncached)